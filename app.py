@@ -1,15 +1,58 @@
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.middleware.gzip import GZipMiddleware
 import boto3
-from datetime import datetime, timedelta
-from typing import Optional, Dict, List
+import botocore.session
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, List, Tuple
 import json
+import numpy as np
+import orjson
 from pydantic import BaseModel
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is only needed for Arrow/Parquet responses
+    pa = None
+    pq = None
+try:
+    import brotli
+except ImportError:  # brotli is optional; responses fall back to gzip
+    brotli = None
 import os
-from botocore.exceptions import ClientError, NoCredentialsError
+import csv
+import glob
+import gzip
+import hashlib
+import re
+import asyncio
+import sqlite3
+import contextvars
+import functools
+import heapq
+import itertools
+import math
+import random
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from botocore.credentials import AssumeRoleCredentialFetcher, CredentialProvider, DeferredRefreshableCredentials
+from botocore.exceptions import ClientError, NoCredentialsError, ConnectionError as BotoConnectionError, HTTPClientError
 
-app = FastAPI(title="AWS Cost Analysis API", version="1.0.0")
+app = FastAPI(title="AWS Cost Analysis API", version="1.0.0", default_response_class=ORJSONResponse)
+
+# Response compression settings
+RESPONSE_COMPRESS_MIN_SIZE = int(os.environ.get('RESPONSE_COMPRESS_MIN_SIZE', '1000'))
+RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', '6'))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', '4'))
+
+# Gzip for everything else (forecasts, docs); responses that already set
+# Content-Encoding, like NDJSON streams, are passed through untouched
+app.add_middleware(GZipMiddleware, minimum_size=RESPONSE_COMPRESS_MIN_SIZE, compresslevel=RESPONSE_GZIP_LEVEL)
 
 # Pydantic models for request/response
 class CostRequest(BaseModel):
@@ -17,22 +60,2624 @@ class CostRequest(BaseModel):
     end_date: str
     granularity: str = "DAILY"  # DAILY, MONTHLY, HOURLY
     group_by: Optional[str] = None  # SERVICE, REGION, USAGE_TYPE, etc.
+    stream: bool = False  # Stream rows as NDJSON instead of one CostResponse
+
+class AccountsCostRequest(CostRequest):
+    accounts: Optional[List[str]] = None  # Names from CE_ACCOUNTS; all of them when omitted
+
+class CostResponse(BaseModel):
+    total_cost: float
+    currency: str
+    data: List[Dict]
+    chart_data: Dict
+
+# Cost Explorer client settings
+CE_REGION = os.environ.get('CE_REGION', 'ap-south-1')  # Cost Explorer is only available in ap-south-1
+CE_MAX_POOL_CONNECTIONS = int(os.environ.get('CE_MAX_POOL_CONNECTIONS', '20'))
+CE_TCP_KEEPALIVE = os.environ.get('CE_TCP_KEEPALIVE', 'true').lower() in ('1', 'true', 'yes')
+CE_EXECUTOR_WORKERS = int(os.environ.get('CE_EXECUTOR_WORKERS', str(CE_MAX_POOL_CONNECTIONS)))
+
+# Response cache settings (TTLs in seconds)
+CE_CACHE_MAX_ENTRIES = int(os.environ.get('CE_CACHE_MAX_ENTRIES', '1024'))
+CE_CACHE_TTLS = {
+    'HOURLY': int(os.environ.get('CE_CACHE_TTL_HOURLY', '300')),
+    'DAILY': int(os.environ.get('CE_CACHE_TTL_DAILY', '900')),
+    'MONTHLY': int(os.environ.get('CE_CACHE_TTL_MONTHLY', '3600'))
+}
+CE_CACHE_CLOSED_TTL = int(os.environ.get('CE_CACHE_CLOSED_TTL', str(7 * 24 * 3600)))
+# Expired entries are still served, marked stale, for this long while they are refreshed (0 disables)
+CE_CACHE_MAX_STALE = int(os.environ.get('CE_CACHE_MAX_STALE', '3600'))
+# 'memory' keeps the cache per process; 'sqlite' shares it between worker processes on the host
+CE_CACHE_BACKEND = os.environ.get('CE_CACHE_BACKEND', 'memory')
+CE_CACHE_SQLITE_PATH = os.environ.get('CE_CACHE_SQLITE_PATH', 'ce_cache.db')
+CE_CACHE_SQLITE_TIMEOUT = float(os.environ.get('CE_CACHE_SQLITE_TIMEOUT', '1'))
+CE_CACHE_LEASE_POLL_INTERVAL = float(os.environ.get('CE_CACHE_LEASE_POLL_INTERVAL', '0.05'))
+
+# Client-side rate limiting and retries for Cost Explorer calls
+CE_RATE_LIMIT = float(os.environ.get('CE_RATE_LIMIT', '5'))  # requests per second ceiling
+CE_RATE_LIMIT_MIN = float(os.environ.get('CE_RATE_LIMIT_MIN', '0.2'))
+CE_RATE_LIMIT_INCREASE = float(os.environ.get('CE_RATE_LIMIT_INCREASE', '0.05'))  # added per successful call
+CE_RATE_LIMIT_BURST = float(os.environ.get('CE_RATE_LIMIT_BURST', '5'))
+CE_RETRY_MAX_ATTEMPTS = int(os.environ.get('CE_RETRY_MAX_ATTEMPTS', '5'))
+CE_RETRY_BASE_DELAY = float(os.environ.get('CE_RETRY_BASE_DELAY', '0.2'))
+CE_RETRY_MAX_DELAY = float(os.environ.get('CE_RETRY_MAX_DELAY', '10'))
+CE_REQUEST_DEADLINE = float(os.environ.get('CE_REQUEST_DEADLINE', '30'))
+
+# Data source: 'cost_explorer' calls AWS, 'cur' reads local Cost and Usage Reports
+COST_DATA_SOURCE = os.environ.get('COST_DATA_SOURCE', 'cost_explorer')
+CUR_DIRECTORY = os.environ.get('CUR_DIRECTORY', 'cur')
+CUR_CHUNK_ROWS = int(os.environ.get('CUR_CHUNK_ROWS', '100000'))
+CUR_REFRESH_INTERVAL = float(os.environ.get('CUR_REFRESH_INTERVAL', '300'))
+# Dictionaries are only compacted once they hold more than twice this many labels
+CUR_DICTIONARY_MIN_SIZE = 1024
+
+# Forecasts: 'local' models daily history with NumPy, 'cost_explorer' calls GetCostForecast
+FORECAST_ENGINE = os.environ.get('FORECAST_ENGINE', 'local')
+FORECAST_HISTORY_DAYS = int(os.environ.get('FORECAST_HISTORY_DAYS', os.environ.get('CUR_FORECAST_HISTORY_DAYS', '90')))
+
+# Month-aligned shards fetched concurrently for multi-month ranges
+CE_SHARD_CONCURRENCY = int(os.environ.get('CE_SHARD_CONCURRENCY', '4'))
+# Pages each shard may fetch ahead of the one being read
+CE_SHARD_BUFFER_PAGES = int(os.environ.get('CE_SHARD_BUFFER_PAGES', '2'))
+
+# Persistent store for closed billing days ('' disables it)
+COST_STORE_PATH = os.environ.get('COST_STORE_PATH', 'cost_store.db')
+COST_STORE_SETTLE_DAYS = int(os.environ.get('COST_STORE_SETTLE_DAYS', '3'))
+
+# Service leaderboards kept in memory for the standard /costs/services windows
+LEADERBOARD_WINDOWS = [int(days) for days in os.environ.get('LEADERBOARD_WINDOWS', '7,30,90,365').split(',') if days.strip()]
+LEADERBOARD_REFRESH_INTERVAL = float(os.environ.get('LEADERBOARD_REFRESH_INTERVAL', '900'))
+LEADERBOARD_MAX_AGE = float(os.environ.get('LEADERBOARD_MAX_AGE', '3600'))
+
+# Member accounts for /costs/accounts: comma-separated name=profile or name=role ARN to assume
+CE_ACCOUNTS = os.environ.get('CE_ACCOUNTS', '')
+CE_ACCOUNT_CONCURRENCY = int(os.environ.get('CE_ACCOUNT_CONCURRENCY', '8'))
+CE_ASSUME_ROLE_SESSION_NAME = os.environ.get('CE_ASSUME_ROLE_SESSION_NAME', 'cost-analysis-api')
+
+# Hot queries prefetched after startup: the dashboard defaults plus a JSON list in this file
+CACHE_WARMUP = os.environ.get('CACHE_WARMUP', 'true').lower() in ('1', 'true', 'yes')
+CACHE_WARMUP_FILE = os.environ.get('CACHE_WARMUP_FILE', 'warmup_queries.json')
+
+class AssumedRoleProvider(CredentialProvider):
+    """
+    Credential provider handing out refreshable credentials for a role,
+    put ahead of the default chain of a session
+    """
+
+    METHOD = 'assume-role'
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+
+    def load(self):
+        return self.credentials
+
+class CostExplorerClientManager:
+    """
+    Process-wide holder for a single pooled Cost Explorer client.
+
+    boto3 clients are thread-safe once built, but building one (resolving
+    credentials, loading the service model, opening a connection pool) is
+    slow and not thread-safe, so it happens once under a lock. Credentials
+    resolved through the default provider chain (IAM role, SSO, assume-role
+    profiles) are refreshable and renew themselves inside the client. With
+    a role_arn, the client instead uses credentials for that role, assumed
+    on first use and renewed by botocore before they expire.
+    """
+
+    def __init__(self, region_name: str = CE_REGION, max_pool_connections: int = CE_MAX_POOL_CONNECTIONS,
+                 tcp_keepalive: bool = CE_TCP_KEEPALIVE, profile_name: Optional[str] = None,
+                 role_arn: Optional[str] = None):
+        self.region_name = region_name
+        self.max_pool_connections = max_pool_connections
+        self.tcp_keepalive = tcp_keepalive
+        self.profile_name = profile_name
+        self.role_arn = role_arn
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _create_session(self):
+        if self.role_arn is None:
+            return boto3.session.Session(profile_name=self.profile_name)
+        # Both sessions use the same profile: one supplies the source credentials
+        # and STS client, the other serves the assumed role's credentials
+        source = botocore.session.Session(profile=self.profile_name)
+        fetcher = AssumeRoleCredentialFetcher(
+            source.create_client, source.get_credentials(), self.role_arn,
+            extra_args={'RoleSessionName': CE_ASSUME_ROLE_SESSION_NAME}
+        )
+        botocore_session = botocore.session.Session(profile=self.profile_name)
+        botocore_session.get_component('credential_provider').insert_before(
+            'env', AssumedRoleProvider(DeferredRefreshableCredentials(fetcher.fetch_credentials, 'assume-role'))
+        )
+        return boto3.session.Session(botocore_session=botocore_session)
+
+    def _create_client(self):
+        session = self._create_session()
+        config = Config(
+            region_name=self.region_name,
+            max_pool_connections=self.max_pool_connections,
+            tcp_keepalive=self.tcp_keepalive,
+            retries={'mode': 'standard', 'max_attempts': 1}  # retries are handled by call_ce_with_retry
+        )
+        return session.client('ce', config=config)
+
+    def get_client(self):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._create_client()
+                client = self._client
+        return client
+
+    def set_client(self, client):
+        """
+        Replace the shared client, e.g. with a botocore Stubber-backed client in tests
+        """
+        with self._lock:
+            self._client = client
+
+    def reset(self):
+        """
+        Drop the shared client so the next call builds a fresh one
+        """
+        self.set_client(None)
+
+ce_client_manager = CostExplorerClientManager()
+
+def get_cost_explorer_client():
+    account = ce_account.get()
+    try:
+        if account is not None:
+            return account.client_manager.get_client()
+        return ce_client_manager.get_client()
+    except NoCredentialsError:
+        raise HTTPException(
+            status_code=500, 
+            detail="AWS credentials not configured. Please set AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY environment variables."
+        )
+
+# Dedicated pool for blocking boto3 calls, sized to the client's connection pool
+ce_executor = ThreadPoolExecutor(max_workers=CE_EXECUTOR_WORKERS, thread_name_prefix='ce-call')
+
+async def run_ce_call(method: str, **kwargs):
+    """
+    Run a blocking Cost Explorer API call on the dedicated executor so the
+    event loop keeps serving other requests while it waits on AWS
+    """
+    ce_client = get_cost_explorer_client()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(ce_executor, functools.partial(getattr(ce_client, method), **kwargs))
+
+# Priority classes for queued CE calls; lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# Per-request CE call settings, inherited by tasks spawned while serving the request
+ce_priority = contextvars.ContextVar('ce_priority', default=PRIORITY_INTERACTIVE)
+ce_deadline = contextvars.ContextVar('ce_deadline', default=None)
+# The member account CE calls go to; None uses the default credentials
+ce_account = contextvars.ContextVar('ce_account', default=None)
+
+THROTTLING_ERROR_CODES = {
+    'ThrottlingException', 'LimitExceededException', 'TooManyRequestsException', 'RequestLimitExceeded'
+}
+
+def is_throttling_error(error: Exception) -> bool:
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket shared by every Cost Explorer call in the process.
+
+    The refill rate adapts AIMD-style: it is halved on each throttle response
+    and grows by a fixed step after each successful call. Callers waiting for
+    a token are served by priority class, then in arrival order.
+    """
+
+    def __init__(self, max_rate: float = CE_RATE_LIMIT, min_rate: float = CE_RATE_LIMIT_MIN,
+                 increase: float = CE_RATE_LIMIT_INCREASE, burst: float = CE_RATE_LIMIT_BURST):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.burst = burst
+        self.rate = max_rate
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._queue = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._dispatcher = None
+        self.granted = 0
+        self.throttles = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, priority: int, deadline: float):
+        loop = asyncio.get_running_loop()
+        if self._dispatcher is not None and self._dispatcher.get_loop() is not loop:
+            # Left over from a previous event loop (e.g. between test clients)
+            self._queue = []
+            self._dispatcher = None
+        future = loop.create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        await asyncio.wait_for(future, max(0.0, deadline - time.monotonic()))
+
+    async def _dispatch(self):
+        while self._queue:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                self._tokens -= 1
+                self.granted += 1
+                future.set_result(None)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self):
+        self.throttles += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+
+    def stats(self) -> Dict:
+        return {
+            'rate': round(self.rate, 3),
+            'max_rate': self.max_rate,
+            'queued': len(self._queue),
+            'granted': self.granted,
+            'throttles': self.throttles
+        }
+
+ce_rate_limiter = AdaptiveRateLimiter()
+
+class CostAccount:
+    """
+    A member account queried by /costs/accounts. Cost Explorer quotas are
+    per account, so each one has its own client and rate limiter.
+    """
+
+    def __init__(self, name: str, profile_name: Optional[str] = None, role_arn: Optional[str] = None):
+        self.name = name
+        self.client_manager = CostExplorerClientManager(profile_name=profile_name, role_arn=role_arn)
+        self.rate_limiter = AdaptiveRateLimiter()
+
+    def stats(self) -> Dict:
+        return {
+            'profile': self.client_manager.profile_name,
+            'role_arn': self.client_manager.role_arn,
+            'rate_limiter': self.rate_limiter.stats()
+        }
+
+def parse_accounts(spec: str) -> Dict[str, CostAccount]:
+    """
+    Parse CE_ACCOUNTS entries: name=arn:aws:iam::...:role/... assumes that
+    role, name=profile uses that profile, and a bare name is a profile too
+    """
+    accounts = {}
+    for entry in spec.split(','):
+        name, _, target = entry.strip().partition('=')
+        if not name:
+            continue
+        target = target.strip() or name
+        if target.startswith('arn:'):
+            accounts[name] = CostAccount(name, role_arn=target)
+        else:
+            accounts[name] = CostAccount(name, profile_name=target)
+    return accounts
+
+ce_accounts = parse_accounts(CE_ACCOUNTS)
+
+async def call_ce_with_retry(method: str, **kwargs):
+    """
+    Make a rate-limited Cost Explorer call, retrying throttles and connection
+    errors with decorrelated jitter until the request's deadline.
+
+    Raises asyncio.TimeoutError once the deadline has passed.
+    """
+    deadline = ce_deadline.get() or time.monotonic() + CE_REQUEST_DEADLINE
+    priority = ce_priority.get()
+    account = ce_account.get()
+    rate_limiter = account.rate_limiter if account is not None else ce_rate_limiter
+    delay = CE_RETRY_BASE_DELAY
+    for attempt in range(1, CE_RETRY_MAX_ATTEMPTS + 1):
+        await rate_limiter.acquire(priority, deadline)
+        try:
+            result = await asyncio.wait_for(run_ce_call(method, **kwargs), max(0.0, deadline - time.monotonic()))
+        except (ClientError, BotoConnectionError, HTTPClientError) as e:
+            throttled = is_throttling_error(e)
+            if isinstance(e, ClientError) and not throttled:
+                raise
+            if throttled:
+                rate_limiter.on_throttle()
+            delay = min(CE_RETRY_MAX_DELAY, random.uniform(CE_RETRY_BASE_DELAY, delay * 3))
+            if attempt == CE_RETRY_MAX_ATTEMPTS or time.monotonic() + delay >= deadline:
+                raise
+            await asyncio.sleep(delay)
+        else:
+            rate_limiter.on_success()
+            return result
+
+class MemoryCacheBackend:
+    """
+    In-process LRU storage for QueryCache. Also the stand-in for the shared
+    backend in tests: leases always succeed since there are no other processes.
+    """
+
+    name = 'memory'
+    clock = staticmethod(time.monotonic)
+    blocking = False
+
+    def __init__(self, max_entries: int = CE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, expires_at: float, value) -> int:
+        """
+        Store an entry and return how many entries were evicted to make room
+        """
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def count(self) -> int:
+        return len(self._entries)
+
+    def acquire_lease(self, key: str, ttl: float) -> bool:
+        return True
+
+    def release_lease(self, key: str):
+        pass
+
+    def lease_held(self, key: str) -> bool:
+        return False
+
+class SqliteCacheBackend:
+    """
+    QueryCache storage shared by every worker process on the host, in a
+    SQLite database in WAL mode so readers never block each other.
+
+    Values are stored as JSON. Expiry uses wall-clock time, because
+    monotonic clocks are not comparable across processes. Leases let one
+    process fetch a key while the others wait for it to be filled. A lease
+    expires on its own if its holder dies.
+    """
+
+    name = 'sqlite'
+    clock = staticmethod(time.time)
+    blocking = True  # may wait up to CE_CACHE_SQLITE_TIMEOUT on another process's write lock
+
+    def __init__(self, path: str, max_entries: int = CE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Reconnect after a fork (e.g. gunicorn --preload): connections must not cross processes
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=CE_CACHE_SQLITE_TIMEOUT, check_same_thread=False,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache_entries ('
+                'key TEXT PRIMARY KEY, expires_at REAL NOT NULL, used_at REAL NOT NULL, value BLOB NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_entries_used_at ON cache_entries (used_at)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache_leases (key TEXT PRIMARY KEY, owner INTEGER NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, key: str):
+        try:
+            with self._lock:
+                conn = self._connection()
+                row = conn.execute('SELECT expires_at, used_at, value FROM cache_entries WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    return None
+                now = time.time()
+                # Recency only needs to be roughly right for LRU, so skip most of these writes
+                if now - row[1] > 60:
+                    conn.execute('UPDATE cache_entries SET used_at = ? WHERE key = ?', (now, key))
+        except sqlite3.Error:
+            return None
+        return row[0], orjson.loads(row[2])
+
+    def set(self, key: str, expires_at: float, value) -> int:
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute('INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?)',
+                             (key, expires_at, time.time(), orjson.dumps(value)))
+                self._writes += 1
+                if self._writes % 64:
+                    return 0
+                return conn.execute(
+                    'DELETE FROM cache_entries WHERE key IN '
+                    '(SELECT key FROM cache_entries ORDER BY used_at DESC LIMIT -1 OFFSET ?)',
+                    (self.max_entries,)
+                ).rowcount
+        except sqlite3.Error:
+            return 0
+
+    def delete(self, key: str):
+        try:
+            with self._lock:
+                self._connection().execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+        except sqlite3.Error:
+            pass
+
+    def clear(self):
+        try:
+            with self._lock:
+                self._connection().execute('DELETE FROM cache_entries')
+        except sqlite3.Error:
+            pass
+
+    def count(self) -> int:
+        try:
+            with self._lock:
+                return self._connection().execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def acquire_lease(self, key: str, ttl: float) -> bool:
+        now = time.time()
+        try:
+            with self._lock:
+                return self._connection().execute(
+                    'INSERT INTO cache_leases VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE '
+                    'SET owner = excluded.owner, expires_at = excluded.expires_at '
+                    'WHERE cache_leases.owner = excluded.owner OR cache_leases.expires_at <= ?',
+                    (key, os.getpid(), now + ttl, now)
+                ).rowcount == 1
+        except sqlite3.Error:
+            # Fetching without the lease only costs a duplicate CE call
+            return True
+
+    def release_lease(self, key: str):
+        try:
+            with self._lock:
+                self._connection().execute('DELETE FROM cache_leases WHERE key = ? AND owner = ?', (key, os.getpid()))
+        except sqlite3.Error:
+            pass
+
+    def lease_held(self, key: str) -> bool:
+        try:
+            with self._lock:
+                return self._connection().execute(
+                    'SELECT 1 FROM cache_leases WHERE key = ? AND expires_at > ?', (key, time.time())
+                ).fetchone() is not None
+        except sqlite3.Error:
+            return False
+
+class QueryCache:
+    """
+    Thread-safe LRU cache whose entries each carry their own expiry time,
+    stored in a pluggable backend (in-process memory by default).
+    Expired entries are kept for max_stale more seconds so lookup() can
+    still serve them, marked stale.
+    """
+
+    def __init__(self, max_entries: int = CE_CACHE_MAX_ENTRIES, max_stale: float = 0, backend=None):
+        self.max_entries = max_entries
+        self.max_stale = max_stale
+        self.backend = backend or MemoryCacheBackend(max_entries)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key: str, allow_stale: bool = True):
+        """
+        Return (value, expires_in), or (None, 0) on a miss. expires_in is
+        the number of seconds the entry stays fresh, 0 or less once stale.
+        """
+        entry = self.backend.get(key)
+        now = self.backend.clock()
+        if entry is not None and entry[0] + self.max_stale <= now:
+            self.backend.delete(key)
+            entry = None
+        with self._lock:
+            if entry is None or (entry[0] <= now and not allow_stale):
+                self.misses += 1
+                return None, 0
+            if entry[0] <= now:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            return entry[1], entry[0] - now
+
+    def get(self, key: str):
+        return self.lookup(key, allow_stale=False)[0]
+
+    def set(self, key: str, value, ttl: float):
+        evicted = self.backend.set(key, self.backend.clock() + ttl, value)
+        with self._lock:
+            self.evictions += evicted
+
+    async def run_backend(self, fn, *args):
+        """
+        Call fn, on a worker thread if the backend can block, so a shared
+        backend locked by another process does not stall the event loop
+        """
+        if not self.backend.blocking:
+            return fn(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(fn, *args))
+
+    async def lookup_async(self, key: str, allow_stale: bool = True):
+        return await self.run_backend(self.lookup, key, allow_stale)
+
+    async def set_async(self, key: str, value, ttl: float):
+        await self.run_backend(self.set, key, value, ttl)
+
+    async def wait_for_fill(self, key: str, timeout: float):
+        """
+        Wait for another process holding the lease on key to cache a fresh
+        value. Returns None if it gives up, fails or takes too long.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(CE_CACHE_LEASE_POLL_INTERVAL)
+            entry = await self.run_backend(self.backend.get, key)
+            if entry is not None and entry[0] > self.backend.clock():
+                with self._lock:
+                    self.hits += 1
+                return entry[1]
+            if not await self.run_backend(self.backend.lease_held, key):
+                return None
+        return None
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> Dict:
+        entries = self.backend.count()
+        with self._lock:
+            return {
+                'backend': self.backend.name,
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+def make_cache_backend():
+    if CE_CACHE_BACKEND == 'sqlite':
+        return SqliteCacheBackend(CE_CACHE_SQLITE_PATH, CE_CACHE_MAX_ENTRIES)
+    return MemoryCacheBackend(CE_CACHE_MAX_ENTRIES)
+
+query_cache = QueryCache(max_stale=CE_CACHE_MAX_STALE, backend=make_cache_backend())
+
+def normalize_query(method: str, query: Dict) -> str:
+    """
+    Build a cache key from the parts of a CE query that affect its result
+    """
+    normalized = {
+        'method': method,
+        'TimePeriod': query.get('TimePeriod'),
+        'Granularity': query.get('Granularity'),
+        'Metrics': sorted(query.get('Metrics', [])),
+        'GroupBy': query.get('GroupBy', []),
+        'Filter': query.get('Filter'),
+        'Metric': query.get('Metric'),
+        'NextPageToken': query.get('NextPageToken')
+    }
+    account = ce_account.get()
+    if account is not None:
+        normalized['Account'] = account.name
+    return json.dumps(normalized, sort_keys=True)
+
+def closed_before() -> str:
+    """
+    First day (UTC) that is still part of an open billing month. AWS keeps
+    revising a month until COST_STORE_SETTLE_DAYS after it ends; days
+    before this one have settled, for both the cache and the cost store.
+    """
+    settled = datetime.now(timezone.utc) - timedelta(days=COST_STORE_SETTLE_DAYS)
+    return settled.strftime('%Y-%m-01')
+
+def query_ttl(query: Dict) -> int:
+    """
+    Pick the cache TTL for a CE query: closed periods no longer change, so
+    they are kept much longer. End is exclusive, so a period is closed when
+    it ends on or before closed_before().
+    """
+    if query['TimePeriod']['End'] <= closed_before():
+        return CE_CACHE_CLOSED_TTL
+    return CE_CACHE_TTLS.get(query.get('Granularity', 'DAILY'), CE_CACHE_TTLS['DAILY'])
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key onto one in-flight task.
+
+    The first caller starts the task; later callers await the same result,
+    and an error is raised to every one of them. Waiters are shielded so a
+    cancelled request does not cancel the call for the others.
+    """
+
+    def __init__(self):
+        self._in_flight = {}  # key -> asyncio.Future
+        self.leaders = 0
+        self.coalesced_waiters = 0
+
+    async def do(self, key: str, fn):
+        future, started = self.start(key, fn)
+        if not started:
+            self.coalesced_waiters += 1
+        return await asyncio.shield(future)
+
+    def start(self, key: str, fn):
+        """
+        Start fn for key unless a call is already in flight. Returns the
+        in-flight future and whether this call started it.
+        """
+        future = self._in_flight.get(key)
+        if future is not None and future.get_loop() is asyncio.get_running_loop():
+            return future, False
+        self.leaders += 1
+        future = asyncio.ensure_future(fn())
+        self._in_flight[key] = future
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future, True
+
+    def _forget(self, key: str, future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        if not future.cancelled():
+            # Mark the exception retrieved even if every waiter went away
+            future.exception()
+
+    def stats(self) -> Dict:
+        return {
+            'in_flight': len(self._in_flight),
+            'leaders': self.leaders,
+            'coalesced_waiters': self.coalesced_waiters
+        }
+
+ce_single_flight = SingleFlight()
+
+# Set by a request to a dict that cached_ce_call marks when it serves stale
+# data, and in which it keeps the shortest time any data used stays fresh
+ce_staleness = contextvars.ContextVar('ce_staleness', default=None)
+# Set while a query may only be answered from cached data
+ce_cache_only = contextvars.ContextVar('ce_cache_only', default=False)
+# Set while a query must be answered from fresh AWS data, which still refills the cache
+ce_bypass_cache = contextvars.ContextVar('ce_bypass_cache', default=False)
+
+class CacheMiss(Exception):
+    """
+    Raised by cached_ce_call in cache-only mode instead of calling AWS
+    """
+
+def note_freshness(expires_in: float):
+    """
+    Record in the request's staleness dict how long data it used stays fresh
+    """
+    staleness = ce_staleness.get()
+    if staleness is None:
+        return
+    if expires_in <= 0:
+        staleness['stale'] = True
+    staleness['expires_in'] = min(staleness.get('expires_in', expires_in), expires_in)
+
+async def cached_ce_call(method: str, **query):
+    """
+    Run a Cost Explorer call through the response cache, coalescing
+    identical concurrent misses into a single AWS request. A stale entry
+    is returned as-is while one background call per key refreshes it.
+    """
+    key = normalize_query(method, query)
+
+    async def fetch():
+        # With a shared backend another worker process may already be fetching this key
+        if not await query_cache.run_backend(query_cache.backend.acquire_lease, key, CE_REQUEST_DEADLINE):
+            shared = await query_cache.wait_for_fill(key, CE_REQUEST_DEADLINE)
+            if shared is not None:
+                return shared
+        try:
+            result = await call_ce_with_retry(method, **query)
+            await query_cache.set_async(key, result, query_ttl(query))
+        finally:
+            await query_cache.run_backend(query_cache.backend.release_lease, key)
+        return result
+
+    async def revalidate():
+        # Runs in its own task, so these do not leak into the request
+        ce_priority.set(PRIORITY_BACKGROUND)
+        ce_deadline.set(time.monotonic() + CE_REQUEST_DEADLINE)
+        return await fetch()
+
+    if ce_bypass_cache.get():
+        response, expires_in = None, 0
+    else:
+        response, expires_in = await query_cache.lookup_async(key)
+    if response is None:
+        if ce_cache_only.get():
+            raise CacheMiss(key)
+        response = await ce_single_flight.do(key, fetch)
+        expires_in = query_ttl(query)
+    elif expires_in <= 0:
+        ce_single_flight.start(key, revalidate)
+    note_freshness(expires_in)
+    return response
+
+def cancel_pending(task: asyncio.Future):
+    """
+    Cancel a prefetch nobody will await, without leaving its error unretrieved
+    """
+    task.cancel()
+    task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+async def iter_cost_and_usage_pages(query: Dict):
+    """
+    Yield the ResultsByTime of every GetCostAndUsage page, following NextPageToken.
+
+    The next page is requested while the caller is still processing the
+    current one. Only that single page is ever fetched ahead, so memory stays
+    bounded no matter how many pages the query returns.
+    """
+    pending = asyncio.ensure_future(cached_ce_call('get_cost_and_usage', **query))
+    try:
+        while pending is not None:
+            response = await pending
+            next_token = response.get('NextPageToken')
+            if next_token:
+                pending = asyncio.ensure_future(
+                    cached_ce_call('get_cost_and_usage', **query, NextPageToken=next_token)
+                )
+            else:
+                pending = None
+            yield response['ResultsByTime']
+    finally:
+        if pending is not None:
+            cancel_pending(pending)
+
+def month_shards(start: str, end: str) -> List[Tuple[str, str]]:
+    """
+    Split [start, end) into consecutive month-aligned (start, end) ranges
+    """
+    shards = []
+    shard_start = start
+    while shard_start < end:
+        first_of_month = datetime.strptime(shard_start, '%Y-%m-%d').replace(day=1)
+        next_month = (first_of_month + timedelta(days=32)).replace(day=1).strftime('%Y-%m-%d')
+        shard_end = min(next_month, end)
+        shards.append((shard_start, shard_end))
+        shard_start = shard_end
+    return shards
+
+async def iter_sharded_cost_pages(query: Dict):
+    """
+    Yield ResultsByTime pages for a query, fetching month-aligned shards of
+    its TimePeriod concurrently and yielding them back in date order.
+
+    At most CE_SHARD_CONCURRENCY shards are in flight; every CE call still
+    goes through the shared rate limiter, and shards already in the
+    response cache are served from it without an AWS call. Pages of the
+    shard being read are yielded as they arrive, and the shards behind it
+    hold at most CE_SHARD_BUFFER_PAGES pages each.
+
+    Only DAILY and HOURLY queries are sharded, since they are the ones that
+    page. A MONTHLY query fits in one call, and sharding it would turn one
+    paid call into one per month.
+    """
+    shards = month_shards(query['TimePeriod']['Start'], query['TimePeriod']['End'])
+    if len(shards) <= 1 or query['Granularity'] == 'MONTHLY':
+        async for results in iter_cost_and_usage_pages(query):
+            yield results
+        return
+
+    async def fill_shard(shard_start: str, shard_end: str, queue: asyncio.Queue):
+        shard_query = dict(query, TimePeriod={'Start': shard_start, 'End': shard_end})
+        try:
+            async for results in iter_cost_and_usage_pages(shard_query):
+                await queue.put(results)
+        except Exception as e:
+            await queue.put(e)  # Raised by the reader once it gets to this shard
+        else:
+            await queue.put(None)
+
+    def start_shard(shard: Tuple[str, str]):
+        queue = asyncio.Queue(maxsize=CE_SHARD_BUFFER_PAGES)
+        pending.append((asyncio.ensure_future(fill_shard(*shard, queue)), queue))
+
+    remaining = iter(shards)
+    pending = deque()
+    for shard in itertools.islice(remaining, CE_SHARD_CONCURRENCY):
+        start_shard(shard)
+    try:
+        while pending:
+            _, queue = pending[0]
+            while True:
+                results = await queue.get()
+                if results is None:
+                    break
+                if isinstance(results, Exception):
+                    raise results
+                yield results
+            pending.popleft()
+            for shard in itertools.islice(remaining, 1):
+                start_shard(shard)
+    finally:
+        for task, _ in pending:
+            cancel_pending(task)
+
+class CostStore:
+    """
+    SQLite store of daily Cost Explorer rows for closed billing days.
+
+    Rows are kept per day, per group of the GroupBy dimension ('' when the
+    query is not grouped) and per metric. A day only counts as stored once
+    every page of the query that fetched it has been written.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Worker processes share the file; WAL keeps their reads from blocking on a writer
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS cost_rows ('
+                'dimension TEXT, day TEXT, grp TEXT, metric TEXT, amount TEXT, unit TEXT, '
+                'PRIMARY KEY (dimension, day, grp, metric))'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS stored_days ('
+                'dimension TEXT, day TEXT, metrics TEXT, PRIMARY KEY (dimension, day))'
+            )
+
+    def stored_days(self, dimension: str, metrics: List[str], start: str, end: str) -> set:
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT day, metrics FROM stored_days WHERE dimension = ? AND day >= ? AND day < ?',
+                (dimension, start, end)
+            ).fetchall()
+        return {day for day, stored in rows if set(metrics) <= set(stored.split(','))}
+
+    def load_results(self, dimension: str, metrics: List[str], start: str, end: str) -> List[Dict]:
+        """
+        Rebuild ResultsByTime entries, in date order, for the stored days in
+        [start, end). Stored days without any rows (no groups or no cost)
+        still get an empty entry, as Cost Explorer returns them.
+        """
+        days = self.stored_days(dimension, metrics, start, end)
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT day, grp, metric, amount, unit FROM cost_rows '
+                'WHERE dimension = ? AND day >= ? AND day < ? ORDER BY day, grp',
+                (dimension, start, end)
+            ).fetchall()
+        results = OrderedDict()
+        for day in sorted(days):
+            next_day = (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+            results[day] = {
+                'TimePeriod': {'Start': day, 'End': next_day},
+                'Total': {},
+                'Groups': OrderedDict(),
+                'Estimated': False
+            }
+        for day, grp, metric, amount, unit in rows:
+            if metric not in metrics or day not in results:
+                continue
+            if dimension:
+                groups = results[day]['Groups']
+                groups.setdefault(grp, {'Keys': [grp], 'Metrics': {}})['Metrics'][metric] = {'Amount': amount, 'Unit': unit}
+            else:
+                results[day]['Total'][metric] = {'Amount': amount, 'Unit': unit}
+        for result in results.values():
+            result['Groups'] = list(result['Groups'].values())
+        return list(results.values())
+
+    def save_results(self, dimension: str, results: List[Dict]):
+        rows = []
+        for result in results:
+            day = result['TimePeriod']['Start']
+            if dimension:
+                for group in result['Groups']:
+                    grp = group['Keys'][0] if group['Keys'] else 'Unknown'
+                    for metric, value in group['Metrics'].items():
+                        rows.append((dimension, day, grp, metric, value['Amount'], value['Unit']))
+            else:
+                for metric, value in result['Total'].items():
+                    rows.append((dimension, day, '', metric, value['Amount'], value['Unit']))
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO cost_rows VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def mark_stored(self, dimension: str, metrics: List[str], days: List[str]):
+        """
+        Record that days hold complete rows for metrics, on top of any
+        metrics already stored for them
+        """
+        if not days:
+            return
+        with self._lock, self._conn:
+            existing = dict(self._conn.execute(
+                'SELECT day, metrics FROM stored_days WHERE dimension = ? AND day >= ? AND day <= ?',
+                (dimension, min(days), max(days))
+            ).fetchall())
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO stored_days VALUES (?, ?, ?)',
+                [(dimension, day, ','.join(sorted(set(metrics) | set(filter(None, existing.get(day, '').split(','))))))
+                 for day in days]
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# Opened by the startup hook, so importing the module creates no files
+cost_store = None
+
+@app.on_event("startup")
+async def open_cost_store():
+    global cost_store
+    if COST_STORE_PATH and cost_store is None:
+        cost_store = CostStore(COST_STORE_PATH)
+
+async def iter_stored_cost_pages(query: Dict):
+    """
+    Yield ResultsByTime pages for a DAILY query, reading closed days from the
+    cost store and fetching only missing or still-open days from AWS
+    """
+    loop = asyncio.get_running_loop()
+    start = query['TimePeriod']['Start']
+    end = query['TimePeriod']['End']
+    dimension = query['GroupBy'][0]['Key'] if query.get('GroupBy') else ''
+    metrics = query['Metrics']
+    stored = await loop.run_in_executor(None, cost_store.stored_days, dimension, metrics, start, end)
+    cutoff = closed_before()
+
+    # Split the range into consecutive runs of stored and to-fetch days
+    runs = []
+    day = datetime.strptime(start, '%Y-%m-%d')
+    while day.strftime('%Y-%m-%d') < end:
+        day_str = day.strftime('%Y-%m-%d')
+        next_day = (day + timedelta(days=1)).strftime('%Y-%m-%d')
+        from_store = day_str in stored and day_str < cutoff
+        if runs and runs[-1][0] == from_store:
+            runs[-1][2] = next_day
+        else:
+            runs.append([from_store, day_str, next_day])
+        day += timedelta(days=1)
+
+    for from_store, run_start, run_end in runs:
+        if from_store:
+            # One day per page, so long stored ranges stream like CE pages do
+            day = datetime.strptime(run_start, '%Y-%m-%d')
+            while day.strftime('%Y-%m-%d') < run_end:
+                day_str = day.strftime('%Y-%m-%d')
+                day += timedelta(days=1)
+                yield await loop.run_in_executor(None, cost_store.load_results, dimension, metrics,
+                                                 day_str, day.strftime('%Y-%m-%d'))
+            continue
+        run_query = dict(query, TimePeriod={'Start': run_start, 'End': run_end})
+        closed_days = set()
+        async for results in iter_sharded_cost_pages(run_query):
+            closed = [result for result in results if result['TimePeriod']['Start'] < cutoff]
+            if closed:
+                await loop.run_in_executor(None, cost_store.save_results, dimension, closed)
+                closed_days.update(result['TimePeriod']['Start'] for result in closed)
+            yield results
+        if closed_days:
+            await loop.run_in_executor(None, cost_store.mark_stored, dimension, metrics, sorted(closed_days))
+
+def select_cost_pages(query: Dict):
+    """
+    Pick the page source for a GetCostAndUsage query: the cost store for
+    DAILY queries it can represent, sharded Cost Explorer fetches otherwise
+    """
+    group_by = query.get('GroupBy', [])
+    # The store holds the default account's data only
+    if (cost_store is not None and ce_account.get() is None and query['Granularity'] == 'DAILY' and not query.get('Filter')
+            and len(group_by) <= 1 and all(group['Type'] == 'DIMENSION' for group in group_by)):
+        return iter_stored_cost_pages(query)
+    return iter_sharded_cost_pages(query)
+
+# The granularity whose results sum up exactly to each coarser one
+FINER_GRANULARITY = {'MONTHLY': 'DAILY', 'DAILY': 'HOURLY'}
+# Metrics of every /costs/analyze query, so its cached results can answer narrower ones
+ANALYZE_METRICS = ['BlendedCost', 'UnblendedCost', 'UsageQuantity']
+derivation_stats = {'derived': 0, 'fetched': 0}
+
+def resample_results(results: List[Dict], query: Dict) -> List[Dict]:
+    """
+    Sum finer-grained ResultsByTime entries into the query's periods, with
+    one np.bincount per metric over (period, group) cells. Only the query's
+    metrics are kept, so the results may carry more.
+    """
+    edges = period_edges(query['TimePeriod']['Start'], query['TimePeriod']['End'], query['Granularity'])
+    labels = period_labels(edges, query['Granularity'])
+    periods = len(edges) - 1
+    metrics = query['Metrics']
+    grouped = bool(query.get('GroupBy'))
+
+    groups = {}  # keys -> code
+    result_hours, result_sizes, codes = [], [], []
+    amounts = {metric: [] for metric in metrics}
+    units = {metric: None for metric in metrics}
+    estimated = []
+    for result in results:
+        cells = result['Groups'] if grouped else [{'Keys': [], 'Metrics': result['Total']}]
+        result_hours.append(parse_period_bound(result['TimePeriod']['Start']))
+        result_sizes.append(len(cells))
+        estimated.append(result.get('Estimated', False))
+        for cell in cells:
+            codes.append(groups.setdefault(tuple(cell['Keys']), len(groups)))
+            for metric in metrics:
+                value = cell['Metrics'].get(metric)
+                amounts[metric].append(value['Amount'] if value else '0')
+                if value and units[metric] is None:
+                    units[metric] = value['Unit']
+
+    width = max(len(groups), 1)
+    result_buckets = np.searchsorted(edges, np.asarray(result_hours, dtype='datetime64[h]').astype(np.int64), side='right') - 1
+    cells = np.repeat(result_buckets, result_sizes) * width + np.asarray(codes, dtype=np.int64)
+    valid = (cells >= 0) & (cells < periods * width)
+    sums = {
+        metric: np.bincount(cells[valid], weights=np.asarray(amounts[metric], dtype=np.float64)[valid],
+                            minlength=periods * width).reshape(periods, width)
+        for metric in metrics
+    }
+    present = np.bincount(cells[valid], minlength=periods * width).reshape(periods, width) > 0
+    in_range = (result_buckets >= 0) & (result_buckets < periods)
+    period_estimated = np.bincount(result_buckets[in_range], weights=np.asarray(estimated, dtype=np.float64)[in_range],
+                                   minlength=periods) > 0
+    keys = list(groups)
+
+    resampled = []
+    for p in range(periods):
+        result = {
+            'TimePeriod': {'Start': labels[p], 'End': labels[p + 1]},
+            'Total': {},
+            'Groups': [],
+            'Estimated': bool(period_estimated[p])
+        }
+        if grouped:
+            for code in np.flatnonzero(present[p]).tolist():
+                result['Groups'].append({
+                    'Keys': list(keys[code]),
+                    'Metrics': {metric: {'Amount': str(float(sums[metric][p, code])), 'Unit': units[metric] or 'USD'}
+                                for metric in metrics}
+                })
+        else:
+            result['Total'] = {metric: {'Amount': str(float(sums[metric][p, 0])), 'Unit': units[metric] or 'USD'}
+                               for metric in metrics}
+        resampled.append(result)
+    return resampled
+
+async def derive_coarser_results(query: Dict) -> Optional[List[Dict]]:
+    """
+    Answer a query by resampling the same query at the next finer
+    granularity, if every page of that is already cached (or in the cost
+    store). The finer query may also ask for all of ANALYZE_METRICS, so
+    data cached by /costs/analyze answers narrower queries too. Returns
+    None as soon as anything would need an AWS call.
+    """
+    candidates = [query['Metrics']]
+    if set(query['Metrics']) < set(ANALYZE_METRICS):
+        candidates.append(ANALYZE_METRICS)
+    for metrics in candidates:
+        finer_query = dict(query, Granularity=FINER_GRANULARITY[query['Granularity']], Metrics=metrics)
+        token = ce_cache_only.set(True)
+        pages = select_cost_pages(finer_query)
+        try:
+            results = [result async for page in pages for result in page]
+        except CacheMiss:
+            continue
+        finally:
+            await pages.aclose()
+            ce_cache_only.reset(token)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, resample_results, results, query)
+    return None
+
+async def iter_cost_pages(query: Dict):
+    """
+    Yield ResultsByTime pages for a GetCostAndUsage query, rolled up
+    locally from cached finer-grained results when they cover it, and from
+    the selected page source otherwise
+    """
+    if query['Granularity'] in FINER_GRANULARITY and not ce_cache_only.get() and not ce_bypass_cache.get():
+        results = await derive_coarser_results(query)
+        if results is not None:
+            derivation_stats['derived'] += 1
+            yield results
+            return
+    derivation_stats['fetched'] += 1
+    async for results in select_cost_pages(query):
+        yield results
+
+# CUR columns (Parquet/Athena naming) behind each CE dimension and metric
+CUR_DIMENSION_COLUMNS = {
+    'SERVICE': 'product_product_name',
+    'REGION': 'product_region',
+    'USAGE_TYPE': 'line_item_usage_type',
+    'LINKED_ACCOUNT': 'line_item_usage_account_id'
+}
+CUR_METRIC_COLUMNS = {
+    'BlendedCost': 'line_item_blended_cost',
+    'UnblendedCost': 'line_item_unblended_cost',
+    'UsageQuantity': 'line_item_usage_amount'
+}
+FORECAST_METRICS = {'BLENDED_COST': 'BlendedCost', 'UNBLENDED_COST': 'UnblendedCost', 'USAGE_QUANTITY': 'UsageQuantity'}
+CUR_TIME_COLUMN = 'line_item_usage_start_date'
+CUR_CURRENCY_COLUMN = 'line_item_currency_code'
+CUR_COLUMNS = ([CUR_TIME_COLUMN, CUR_CURRENCY_COLUMN, 'line_item_product_code']
+               + list(CUR_DIMENSION_COLUMNS.values()) + list(CUR_METRIC_COLUMNS.values()))
+FORECAST_INTERVAL_Z = 1.2816  # 80% prediction interval, Cost Explorer's default
+FORECAST_SEASON_DAYS = 7
+# (alpha, beta, gamma) candidates for Holt-Winters, picked per series
+FORECAST_HW_GRID = list(itertools.product((0.1, 0.3, 0.5, 0.8), (0.0, 0.05, 0.2), (0.05, 0.2, 0.5)))
+
+class CostExplorerSource:
+    """
+    Data source backed by the AWS Cost Explorer API
+    """
+
+    name = 'cost_explorer'
+
+    def iter_pages(self, query: Dict):
+        return iter_cost_pages(query)
+
+    async def group_totals(self, query: Dict) -> Dict[Tuple[str, ...], float]:
+        return await accumulate_group_totals(self.iter_pages(query), query)
+
+    async def forecast(self, query: Dict) -> Dict:
+        if FORECAST_ENGINE == 'cost_explorer':
+            return await cached_ce_call('get_cost_forecast', **query)
+        return await local_forecast(self, query)
+
+def normalize_cur_column(name: str) -> str:
+    """
+    Map CUR CSV headers to the snake_case names used by Parquet/Athena
+    reports, e.g. 'lineItem/UsageStartDate' -> 'line_item_usage_start_date'
+    """
+    name = name.strip().replace('/', '_')
+    return re.sub(r'(?<=[a-z0-9])(?=[A-Z])', '_', name).lower()
+
+class CurDictionary:
+    """
+    Assigns stable integer codes to the labels of one CUR dimension
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.labels = []
+
+    def encode(self, values: np.ndarray) -> np.ndarray:
+        uniques, inverse = np.unique(values, return_inverse=True)
+        mapped = np.empty(len(uniques), dtype=np.int32)
+        for i, label in enumerate(uniques.tolist()):
+            code = self.codes.get(label)
+            if code is None:
+                code = self.codes[label] = len(self.labels)
+                self.labels.append(label)
+            mapped[i] = code
+        return mapped[inverse.reshape(-1)]
+
+    def copy(self) -> 'CurDictionary':
+        dictionary = CurDictionary()
+        dictionary.codes = dict(self.codes)
+        dictionary.labels = list(self.labels)
+        return dictionary
+
+    def compact(self, used: np.ndarray) -> Tuple['CurDictionary', np.ndarray]:
+        """
+        Keep only the labels whose codes are flagged in used. Returns the new
+        dictionary and an old code -> new code lookup array.
+        """
+        kept = np.flatnonzero(used)
+        mapping = np.full(len(self.labels), -1, dtype=np.int32)
+        mapping[kept] = np.arange(len(kept), dtype=np.int32)
+        dictionary = CurDictionary()
+        dictionary.labels = [self.labels[code] for code in kept.tolist()]
+        dictionary.codes = {label: code for code, label in enumerate(dictionary.labels)}
+        return dictionary, mapping
+
+def compact_cur_rows(hours: np.ndarray, dims: Dict[str, np.ndarray], metrics: Dict[str, np.ndarray]):
+    """
+    Sum rows that share the same hour and dimension codes. The result is
+    sorted by hour, which is what the cube's time index relies on.
+    """
+    keys = np.stack([hours] + [dims[dimension] for dimension in CUR_DIMENSION_COLUMNS], axis=1)
+    unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    compacted_dims = {
+        dimension: unique_keys[:, i + 1].astype(np.int32) for i, dimension in enumerate(CUR_DIMENSION_COLUMNS)
+    }
+    compacted_metrics = {
+        metric: np.bincount(inverse, weights=values, minlength=len(unique_keys)) for metric, values in metrics.items()
+    }
+    return unique_keys[:, 0], compacted_dims, compacted_metrics
+
+def iter_cur_file_chunks(path: str):
+    """
+    Stream a CUR report file as column dicts of at most CUR_CHUNK_ROWS rows
+    """
+    if path.endswith('.parquet'):
+        if pq is None:
+            raise RuntimeError(f"Reading {path} requires pyarrow to be installed")
+        parquet = pq.ParquetFile(path)
+        names = {normalize_cur_column(name): name for name in parquet.schema_arrow.names}
+        for batch in parquet.iter_batches(batch_size=CUR_CHUNK_ROWS, columns=[
+                names[column] for column in CUR_COLUMNS if column in names]):
+            chunk = {}
+            for name in batch.schema.names:
+                column = batch.column(name)
+                if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+                    column = column.fill_null('')
+                elif pa.types.is_floating(column.type) or pa.types.is_integer(column.type):
+                    column = column.fill_null(0)
+                chunk[normalize_cur_column(name)] = column.to_numpy(zero_copy_only=False)
+            yield chunk
+        return
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', newline='') as report:
+        reader = csv.reader(report)
+        header = [normalize_cur_column(name) for name in next(reader)]
+        positions = [(column, header.index(column)) for column in CUR_COLUMNS if column in header]
+        while True:
+            rows = list(itertools.islice(reader, CUR_CHUNK_ROWS))
+            if not rows:
+                return
+            columns = list(zip(*rows))
+            yield {column: np.asarray(columns[position], dtype=object) for column, position in positions}
+
+CUR_ROLLUP_LEVELS = ('HOURLY', 'DAILY', 'MONTHLY')
+
+def rollup_buckets(hours: np.ndarray, level: str) -> np.ndarray:
+    """
+    Start hour of the rollup bucket each epoch hour falls in
+    """
+    if level == 'MONTHLY':
+        return hours.astype('datetime64[h]').astype('datetime64[M]').astype('datetime64[h]').astype(np.int64)
+    if level == 'DAILY':
+        return hours - hours % 24
+    return hours
+
+class CurPartition:
+    """
+    Compacted CUR rows of one billing period, sorted by hour.
+
+    Partitions are immutable once built; files records the (path, checksum)
+    pairs they were parsed from so unchanged periods can be reused.
+    """
+
+    def __init__(self, hours: np.ndarray, dims: Dict[str, np.ndarray], metrics: Dict[str, np.ndarray],
+                 currency: Optional[str] = None, files: Tuple = ()):
+        self.hours = hours
+        self.dims = dims
+        self.metrics = metrics
+        self.currency = currency
+        self.files = files
+        self.rollups = {}
+
+    def build_rollups(self) -> 'CurPartition':
+        """
+        Precompute hourly, daily and monthly sums per dimension (and for
+        no dimension), each level derived from the one below it
+        """
+        for dimension in (None,) + tuple(CUR_DIMENSION_COLUMNS):
+            rows = self
+            for level in CUR_ROLLUP_LEVELS:
+                rows = rollup_rows(rows, level, dimension)
+                self.rollups[(level, dimension)] = rows
+        return self
+
+    @classmethod
+    def empty(cls) -> 'CurPartition':
+        return cls(np.zeros(0, dtype=np.int64),
+                   {dimension: np.zeros(0, dtype=np.int32) for dimension in CUR_DIMENSION_COLUMNS},
+                   {metric: np.zeros(0) for metric in CUR_METRIC_COLUMNS})
+
+    @classmethod
+    def from_files(cls, paths: List[str], dictionaries: Dict[str, CurDictionary], files: Tuple = ()) -> 'CurPartition':
+        currency = None
+        parts = []
+        for path in paths:
+            for chunk in iter_cur_file_chunks(path):
+                if len(chunk[CUR_TIME_COLUMN]) == 0:
+                    continue
+                hours = cur_hours(chunk[CUR_TIME_COLUMN])
+                dims = {}
+                for dimension, column in CUR_DIMENSION_COLUMNS.items():
+                    values = chunk.get(column, np.full(len(hours), '', dtype=object)).astype(str)
+                    if dimension == 'SERVICE' and 'line_item_product_code' in chunk:
+                        # Tax and credit lines have no product name
+                        values = np.where(values == '', chunk['line_item_product_code'].astype(str), values)
+                    dims[dimension] = dictionaries[dimension].encode(values)
+                metrics = {
+                    metric: cur_amounts(chunk.get(column), len(hours)) for metric, column in CUR_METRIC_COLUMNS.items()
+                }
+                if CUR_CURRENCY_COLUMN in chunk:
+                    currency = str(chunk[CUR_CURRENCY_COLUMN][0]) or currency
+                parts.append(compact_cur_rows(hours, dims, metrics))
+        if not parts:
+            partition = cls.empty()
+            partition.files = files
+            return partition.build_rollups()
+        hours, dims, metrics = compact_cur_rows(
+            np.concatenate([part[0] for part in parts]),
+            {dimension: np.concatenate([part[1][dimension] for part in parts]) for dimension in CUR_DIMENSION_COLUMNS},
+            {metric: np.concatenate([part[2][metric] for part in parts]) for metric in CUR_METRIC_COLUMNS}
+        )
+        return cls(hours, dims, metrics, currency, files).build_rollups()
+
+    def slice(self, start_hour: int, end_hour: int) -> Optional['CurPartition']:
+        """
+        Rows in [start_hour, end_hour) as views, or None if there are none
+        """
+        lo, hi = np.searchsorted(self.hours, [start_hour, end_hour])
+        if lo == hi:
+            return None
+        return CurPartition(self.hours[lo:hi], {dimension: codes[lo:hi] for dimension, codes in self.dims.items()},
+                            {metric: values[lo:hi] for metric, values in self.metrics.items()}, self.currency)
+
+    def remap(self, mappings: Dict[str, np.ndarray]) -> 'CurPartition':
+        """
+        Copy of the partition, rollups included, with dimension codes
+        translated through the given lookup arrays
+        """
+        remapped = CurPartition(self.hours, {dimension: mappings[dimension][codes] if dimension in mappings else codes
+                                             for dimension, codes in self.dims.items()},
+                                self.metrics, self.currency, self.files)
+        remapped.rollups = {key: rows.remap(mappings) for key, rows in self.rollups.items()}
+        return remapped
+
+def rollup_rows(rows: CurPartition, level: str, dimension: Optional[str]) -> CurPartition:
+    """
+    Sum rows into (bucket, dimension code) cells, sorted by bucket
+    """
+    keys = rollup_buckets(rows.hours, level) << 32
+    if dimension is not None:
+        keys = keys | rows.dims[dimension].astype(np.int64)
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    dims = {dimension: (unique_keys & 0xFFFFFFFF).astype(np.int32)} if dimension is not None else {}
+    metrics = {
+        metric: np.bincount(inverse, weights=values, minlength=len(unique_keys)) for metric, values in rows.metrics.items()
+    }
+    return CurPartition(unique_keys >> 32, dims, metrics, rows.currency)
+
+class CurCube:
+    """
+    Immutable snapshot of the local cost cube built from CUR line items.
+
+    Rows are compacted to one per (hour, SERVICE, REGION, USAGE_TYPE,
+    LINKED_ACCOUNT) and kept in one partition per billing period, so a time
+    range is a binary search per overlapping partition and every query is a
+    handful of vectorized bincounts. Each partition also carries hourly,
+    daily and monthly rollups per dimension, and plan() routes a query to
+    the coarsest one that answers it. Re-ingestion builds a new snapshot
+    that shares unchanged partitions, and their rollups, with the old one.
+    """
+
+    def __init__(self, partitions: Dict[str, CurPartition], dictionaries: Dict[str, CurDictionary]):
+        self.partitions = partitions
+        self.dictionaries = dictionaries
+        currencies = [partition.currency for _, partition in sorted(partitions.items()) if partition.currency]
+        self.currency = currencies[-1] if currencies else "USD"
+
+    def plan(self, edges: np.ndarray, dimensions) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Pick the coarsest rollup whose buckets tile the query periods and
+        that carries the dimensions the query reads. Returns (level,
+        dimension), or (None, None) when only raw rows can answer it.
+        """
+        if len(dimensions) > 1:
+            return None, None
+        dimension = next(iter(dimensions), None)
+        for level in reversed(CUR_ROLLUP_LEVELS):
+            if np.array_equal(rollup_buckets(edges, level), edges):
+                return level, dimension
+        return None, None
+
+    def rows(self, start_hour: int, end_hour: int, level: Optional[str] = None,
+             dimension: Optional[str] = None) -> CurPartition:
+        """
+        Rows of every partition in [start_hour, end_hour), read from the
+        (level, dimension) rollup when a level is given. Partitions may
+        overlap in time, so the result is not sorted by hour.
+        """
+        slices = []
+        for _, partition in sorted(self.partitions.items()):
+            source = partition if level is None else partition.rollups[(level, dimension)]
+            part = source.slice(start_hour, end_hour)
+            if part is not None:
+                slices.append(part)
+        if len(slices) == 1:
+            return slices[0]
+        if not slices:
+            return CurPartition.empty()
+        return CurPartition(
+            np.concatenate([part.hours for part in slices]),
+            {name: np.concatenate([part.dims[name] for part in slices]) for name in slices[0].dims},
+            {metric: np.concatenate([part.metrics[metric] for part in slices]) for metric in CUR_METRIC_COLUMNS}
+        )
+
+    def select(self, query: Dict):
+        """
+        Rows a GetCostAndUsage query reads, from the rollup the planner
+        picks, with the filter mask and flat group codes of every row
+        """
+        edges = period_edges(query['TimePeriod']['Start'], query['TimePeriod']['End'], query['Granularity'])
+        group_by = [group['Key'] for group in query.get('GroupBy', [])]
+        for dimension in group_by:
+            if dimension not in CUR_DIMENSION_COLUMNS:
+                raise HTTPException(status_code=400, detail=f"Grouping by {dimension} is not supported by the CUR data source")
+        filter_dimension = cur_filter_dimension(query.get('Filter'))
+        level, rollup_dimension = self.plan(edges, set(group_by) | ({filter_dimension} - {None}))
+        rows = self.rows(edges[0], edges[-1], level, rollup_dimension)
+        mask = cur_filter_mask(self, rows, query.get('Filter'))
+        sizes = [len(self.dictionaries[dimension].labels) for dimension in group_by]
+        if len(group_by) == 1:
+            codes = rows.dims[group_by[0]][mask]
+        elif group_by:
+            codes = np.ravel_multi_index([rows.dims[dimension][mask] for dimension in group_by], sizes)
+        else:
+            codes = np.zeros(len(rows.hours[mask]), dtype=np.int64)
+        return edges, group_by, sizes, rows, mask, codes
+
+    def results_by_time(self, query: Dict) -> List[Dict]:
+        """
+        Answer a GetCostAndUsage query with CE-shaped ResultsByTime entries
+        """
+        edges, group_by, sizes, rows, mask, codes = self.select(query)
+        buckets = np.searchsorted(edges, rows.hours[mask], side='right') - 1
+        width = int(np.prod(sizes)) if group_by else 1
+        periods = len(edges) - 1
+        cells = buckets * width + codes
+
+        sums = {
+            metric: np.bincount(cells, weights=rows.metrics[metric][mask],
+                                minlength=periods * width).reshape(periods, width)
+            for metric in query['Metrics']
+        }
+        present = np.bincount(cells, minlength=periods * width).reshape(periods, width) > 0
+        units = {metric: 'N/A' if metric == 'UsageQuantity' else self.currency for metric in query['Metrics']}
+        labels = period_labels(edges, query['Granularity'])
+
+        results = []
+        for p in range(periods):
+            result = {
+                'TimePeriod': {'Start': labels[p], 'End': labels[p + 1]},
+                'Total': {},
+                'Groups': [],
+                'Estimated': False
+            }
+            if group_by:
+                for code in np.flatnonzero(present[p]).tolist():
+                    keys = [self.dictionaries[dimension].labels[i]
+                            for dimension, i in zip(group_by, np.unravel_index(code, sizes))]
+                    result['Groups'].append({
+                        'Keys': keys,
+                        'Metrics': {metric: {'Amount': str(float(sums[metric][p, code])), 'Unit': units[metric]}
+                                    for metric in query['Metrics']}
+                    })
+            else:
+                result['Total'] = {metric: {'Amount': str(float(sums[metric][p, 0])), 'Unit': units[metric]}
+                                   for metric in query['Metrics']}
+            results.append(result)
+        return results
+
+    def group_totals(self, query: Dict) -> Dict[Tuple[str, ...], float]:
+        """
+        Sum of the first metric per group over the whole time range
+        """
+        _, group_by, sizes, rows, mask, codes = self.select(query)
+        width = int(np.prod(sizes)) if group_by else 1
+        sums = np.bincount(codes, weights=rows.metrics[query['Metrics'][0]][mask], minlength=width)
+        cells = np.flatnonzero(np.bincount(codes, minlength=width))
+        if not group_by:
+            return {(): float(sums[0])} if cells.size else {}
+        labels = [np.asarray(self.dictionaries[dimension].labels, dtype=object)[indices]
+                  for dimension, indices in zip(group_by, np.unravel_index(cells, sizes))]
+        return dict(zip(zip(*labels), sums[cells].tolist()))
+
+def cur_hours(values: np.ndarray) -> np.ndarray:
+    """
+    Usage start times as integer hours since the epoch
+    """
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[h]').astype(np.int64)
+    # '2024-01-01T00:00:00Z' -> '2024-01-01T00'
+    return np.asarray(values, dtype='U13').astype('datetime64[h]').astype(np.int64)
+
+def cur_amounts(values: Optional[np.ndarray], size: int) -> np.ndarray:
+    if values is None:
+        return np.zeros(size)
+    values = np.asarray(values)
+    if values.dtype == object:
+        values = np.where(values == '', '0', values)
+    return values.astype(np.float64)
+
+def cur_filter_dimension(cost_filter: Optional[Dict]) -> Optional[str]:
+    """
+    Dimension a CE Filter reads; only a single Dimensions expression is supported
+    """
+    if not cost_filter:
+        return None
+    dimension_filter = cost_filter.get('Dimensions')
+    if not dimension_filter or dimension_filter.get('Key') not in CUR_DIMENSION_COLUMNS:
+        raise HTTPException(status_code=400, detail="Only single Dimensions filters are supported by the CUR data source")
+    return dimension_filter['Key']
+
+def cur_filter_mask(cube: CurCube, rows: CurPartition, cost_filter: Optional[Dict]):
+    """
+    Row mask for a CE Filter, or a full slice (indexing without a copy)
+    when there is no filter
+    """
+    if cur_filter_dimension(cost_filter) is None:
+        return slice(None)
+    dimension_filter = cost_filter['Dimensions']
+    dictionary = cube.dictionaries[dimension_filter['Key']]
+    wanted = [dictionary.codes[value] for value in dimension_filter['Values'] if value in dictionary.codes]
+    return np.isin(rows.dims[dimension_filter['Key']], wanted)
+
+def parse_period_bound(value: str) -> np.datetime64:
+    return np.datetime64(value.rstrip('Z'), 'h')
+
+def period_edges(start: str, end: str, granularity: str) -> np.ndarray:
+    """
+    Period boundaries in epoch hours for [start, end), with MONTHLY periods
+    clipped to the range the way Cost Explorer does
+    """
+    start_hour = parse_period_bound(start)
+    end_hour = parse_period_bound(end)
+    if granularity == 'HOURLY':
+        edges = np.arange(start_hour, end_hour + 1)
+    elif granularity == 'MONTHLY':
+        months = np.arange(start_hour.astype('datetime64[M]') + 1, end_hour.astype('datetime64[M]') + 1)
+        inner = months.astype('datetime64[h]')
+        edges = np.concatenate([[start_hour], inner[inner < end_hour], [end_hour]])
+    else:
+        days = np.arange(start_hour.astype('datetime64[D]'), end_hour.astype('datetime64[D]') + 1)
+        edges = days.astype('datetime64[h]')
+    return edges.astype('datetime64[h]').astype(np.int64)
+
+def period_labels(edges: np.ndarray, granularity: str) -> List[str]:
+    moments = edges.astype('datetime64[h]')
+    if granularity == 'HOURLY':
+        return [label + 'Z' for label in np.datetime_as_string(moments.astype('datetime64[s]'), unit='s').tolist()]
+    return np.datetime_as_string(moments.astype('datetime64[D]'), unit='D').tolist()
+
+def linear_trend_forecast(history: np.ndarray, horizon: int, z: float = FORECAST_INTERVAL_Z):
+    """
+    Fit a least-squares line to every row of history (series x days) at once
+    and extend it horizon days. Returns mean, lower and upper bound arrays of
+    shape (series, horizon); intervals widen with the residual spread.
+    """
+    history = np.atleast_2d(history)
+    length = history.shape[1]
+    x = np.arange(length, dtype=np.float64)
+    x_mean = x.mean()
+    y_mean = history.mean(axis=1, keepdims=True)
+    denominator = max(float(((x - x_mean) ** 2).sum()), 1e-12)
+    slope = ((x - x_mean) * (history - y_mean)).sum(axis=1, keepdims=True) / denominator
+    intercept = y_mean - slope * x_mean
+    residuals = history - (intercept + slope * x)
+    sigma = residuals.std(axis=1, keepdims=True)
+    future = np.arange(length, length + horizon, dtype=np.float64)
+    mean = np.maximum(intercept + slope * future, 0.0)
+    spread = z * sigma * np.sqrt(1 + (future - x_mean) ** 2 / denominator)
+    return mean, np.maximum(mean - spread, 0.0), mean + spread
+
+def holt_winters_forecast(history: np.ndarray, horizon: int, season: int = FORECAST_SEASON_DAYS,
+                          z: float = FORECAST_INTERVAL_Z):
+    """
+    Additive Holt-Winters fitted to every row of history (series x days) at
+    once. Each series gets the smoothing parameters from FORECAST_HW_GRID
+    with the lowest one-step-ahead squared error; all series and parameter
+    sets are filtered together in one pass over the days. Needs at least
+    two seasons of history. Returns mean, lower and upper bound arrays of
+    shape (series, horizon).
+    """
+    history = np.atleast_2d(history).astype(np.float64)
+    series, length = history.shape
+    grid = np.asarray(FORECAST_HW_GRID, dtype=np.float64)
+    y = np.repeat(history, len(grid), axis=0)
+    alpha, beta, gamma = np.tile(grid, (series, 1)).T
+
+    level = y[:, :season].mean(axis=1)
+    trend = (y[:, season:2 * season].mean(axis=1) - level) / season
+    seasonal = y[:, :season] - level[:, None]
+    sse = np.zeros(len(y))
+    for t in range(season, length):
+        slot = t % season
+        error = y[:, t] - (level + trend + seasonal[:, slot])
+        sse += error ** 2
+        new_level = alpha * (y[:, t] - seasonal[:, slot]) + (1 - alpha) * (level + trend)
+        trend = beta * (new_level - level) + (1 - beta) * trend
+        seasonal[:, slot] = gamma * (y[:, t] - new_level) + (1 - gamma) * seasonal[:, slot]
+        level = new_level
+
+    best = np.arange(series) * len(grid) + sse.reshape(series, len(grid)).argmin(axis=1)
+    level, trend, seasonal = level[best, None], trend[best, None], seasonal[best]
+    alpha, beta, gamma = alpha[best, None], beta[best, None], gamma[best, None]
+    sigma = np.sqrt(sse[best, None] / max(length - season, 1))
+
+    steps = np.arange(1, horizon + 1)
+    mean = np.maximum(level + steps * trend + seasonal[:, (length - 1 + steps) % season], 0.0)
+    # Forecast error variance of additive Holt-Winters: sigma^2 * (1 + sum of c_j^2 for j < h)
+    lags = np.arange(1, horizon)
+    c = alpha * (1 + lags * beta) + gamma * (lags % season == 0)
+    variance = np.concatenate([np.zeros((series, 1)), np.cumsum(c ** 2, axis=1)], axis=1) + 1
+    spread = z * sigma * np.sqrt(variance)
+    return mean, np.maximum(mean - spread, 0.0), mean + spread
+
+def forecast_series(history: np.ndarray, horizon: int):
+    """
+    Holt-Winters with weekly seasonality once there are two full weeks of
+    history, a linear trend before that
+    """
+    history = np.atleast_2d(history)
+    if history.shape[1] == 0:
+        empty = np.zeros((history.shape[0], horizon))
+        return empty, empty, empty
+    if history.shape[1] >= 2 * FORECAST_SEASON_DAYS:
+        return holt_winters_forecast(history, horizon)
+    return linear_trend_forecast(history, horizon)
+
+async def local_forecast(source, query: Dict, group_by: Optional[str] = None) -> Dict:
+    """
+    Forecast from the daily history the data source serves (cache, cost
+    store or CUR cube), in the shape of a GetCostForecast response. With
+    group_by, every group is forecast in the same batched pass and
+    returned under 'Groups'.
+    """
+    metric = FORECAST_METRICS[query['Metric']]
+    start = query['TimePeriod']['Start']
+    end = query['TimePeriod']['End']
+    history_start = (datetime.strptime(start, '%Y-%m-%d') - timedelta(days=FORECAST_HISTORY_DAYS)).strftime('%Y-%m-%d')
+    history_query = {
+        'TimePeriod': {'Start': history_start, 'End': start},
+        'Granularity': 'DAILY',
+        'Metrics': [metric]
+    }
+    if group_by:
+        history_query['GroupBy'] = [ranking_group_by(group_by)]
+
+    builder = CostMatrixBuilder(grouped=bool(group_by), metric=metric)
+    estimated = set()
+    async for results in source.iter_pages(history_query):
+        builder.add_results(results)
+        estimated.update(result['TimePeriod']['Start'][:10] for result in results if result.get('Estimated'))
+    matrix = builder.build()
+
+    history_days = {day: i for i, day in enumerate(period_labels(period_edges(history_start, start, 'DAILY'), 'DAILY')[:-1])}
+    rows = [i for i, (period_start, _) in enumerate(matrix.periods) if period_start[:10] in history_days]
+    columns = [history_days[matrix.periods[i][0][:10]] for i in rows]
+    history = np.zeros((len(matrix.groups), len(history_days)))
+    history[:, columns] = matrix.costs[rows].T
+    series = np.vstack([history.sum(axis=0), history]) if group_by else history
+    # Today and trailing Estimated days are still partial and would drag the level
+    # down; they are left out of the fit and forecast like the days after them
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    settled = len(history_days)
+    for day in reversed(list(history_days)):
+        if day < today and day not in estimated:
+            break
+        settled -= 1
+    skipped = len(history_days) - settled
+    series = series[:, :settled]
+    # Days before the first recorded spend would read as zero spend
+    observed = np.flatnonzero(series[0])
+    if observed.size:
+        series = series[:, observed[0]:]
 
-class CostResponse(BaseModel):
-    total_cost: float
-    currency: str
-    data: List[Dict]
-    chart_data: Dict
+    days = period_labels(period_edges(start, end, 'DAILY'), 'DAILY')
+    loop = asyncio.get_running_loop()
+    mean, lower, upper = await loop.run_in_executor(None, forecast_series, series, skipped + len(days) - 1)
+    mean, lower, upper = mean[:, skipped:], lower[:, skipped:], upper[:, skipped:]
+    unit = 'N/A' if metric == 'UsageQuantity' else matrix.currency
 
-# Initialize boto3 client
-def get_cost_explorer_client():
-    try:
-        return boto3.client('ce', region_name='ap-south-1')  # Cost Explorer is only available in ap-south-1
-    except NoCredentialsError:
-        raise HTTPException(
-            status_code=500, 
-            detail="AWS credentials not configured. Please set AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY environment variables."
+    def forecast_result(row: int) -> Dict:
+        return {
+            'Total': {'Amount': str(float(mean[row].sum())), 'Unit': unit},
+            'ForecastResultsByTime': [
+                {
+                    'TimePeriod': {'Start': days[i], 'End': days[i + 1]},
+                    'MeanValue': str(float(mean[row, i])),
+                    'PredictionIntervalLowerBound': str(float(lower[row, i])),
+                    'PredictionIntervalUpperBound': str(float(upper[row, i]))
+                }
+                for i in range(len(days) - 1)
+            ]
+        }
+
+    response = forecast_result(0)
+    if group_by:
+        response['Groups'] = [{'Keys': [group], **forecast_result(i + 1)} for i, group in enumerate(matrix.groups)]
+    return response
+
+def file_checksum(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as report:
+        for block in iter(lambda: report.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class CurSource:
+    """
+    Data source that answers queries from Cost and Usage Report files in a
+    local directory, without calling AWS.
+
+    Each refresh reads the CUR manifests, fingerprints the report files they
+    list and re-parses only the billing periods whose files changed. The new
+    cube snapshot replaces the old one in a single assignment, so queries
+    that already hold a snapshot never see a partial update.
+    """
+
+    name = 'cur'
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.cube = None
+        self.ingested_at = None
+        self.error = None
+        self.dictionaries = {dimension: CurDictionary() for dimension in CUR_DIMENSION_COLUMNS}
+        self.fingerprints = {}
+        self.refresh_lock = threading.Lock()
+        self.last_refresh = {}
+
+    def report_files(self) -> List[str]:
+        paths = []
+        for pattern in ('*.csv', '*.csv.gz', '*.parquet'):
+            paths.extend(glob.glob(os.path.join(self.directory, '**', pattern), recursive=True))
+        return sorted(paths)
+
+    def resolve_report_key(self, key: str) -> Optional[str]:
+        """
+        Local path of an S3 report key from a manifest, matching the longest
+        suffix of the key that exists under the CUR directory
+        """
+        parts = key.split('/')
+        for i in range(len(parts)):
+            path = os.path.join(self.directory, *parts[i:])
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def partition_plan(self) -> Dict[str, Optional[List[str]]]:
+        """
+        Report files per partition: one partition per report and billing
+        period listed in a manifest, or one per file when the directory has
+        no manifests. A partition maps to None while some of its files have
+        not arrived yet.
+        """
+        manifests = {}
+        for path in glob.glob(os.path.join(self.directory, '**', '*-Manifest.json'), recursive=True):
+            try:
+                mtime = os.path.getmtime(path)
+                with open(path) as manifest_file:
+                    manifest = json.load(manifest_file)
+            except (OSError, ValueError):
+                # Being rewritten; the next refresh picks it up
+                continue
+            period = manifest.get('billingPeriod', {}).get('start', '')[:8]
+            key = f"{manifest.get('reportName', '')}/{period}"
+            # The period manifest and the assembly manifest list the same files; keep the newest
+            if key not in manifests or mtime > manifests[key][0]:
+                manifests[key] = (mtime, manifest)
+        if not manifests:
+            return {path: [path] for path in self.report_files()}
+        plan = {}
+        for key, (_, manifest) in manifests.items():
+            paths = [self.resolve_report_key(report_key) for report_key in manifest.get('reportKeys', [])]
+            plan[key] = None if None in paths else paths
+        return plan
+
+    def fingerprint(self, path: str) -> str:
+        """
+        Content checksum of a report file, only recomputed when its mtime or
+        size changed since the last refresh
+        """
+        stat = os.stat(path)
+        known = self.fingerprints.get(path)
+        if known and known[:2] == (stat.st_mtime_ns, stat.st_size):
+            return known[2]
+        checksum = file_checksum(path)
+        self.fingerprints[path] = (stat.st_mtime_ns, stat.st_size, checksum)
+        return checksum
+
+    def compact_dictionaries(self, partitions: Dict[str, CurPartition], dictionaries: Dict[str, CurDictionary]):
+        """
+        Drop labels no partition uses any more (e.g. from replaced billing
+        periods) once they make up more than half of a dictionary, remapping
+        the partitions to the compacted codes
+        """
+        mappings = {}
+        for dimension, dictionary in dictionaries.items():
+            used = np.zeros(len(dictionary.labels), dtype=bool)
+            for partition in partitions.values():
+                used[partition.dims[dimension]] = True
+            if len(dictionary.labels) > 2 * max(int(used.sum()), CUR_DICTIONARY_MIN_SIZE):
+                dictionaries[dimension], mappings[dimension] = dictionary.compact(used)
+        if mappings:
+            partitions = {key: partition.remap(mappings) for key, partition in partitions.items()}
+        return partitions, dictionaries
+
+    def refresh(self) -> bool:
+        """
+        Re-ingest changed billing periods and swap in the new snapshot.
+        Returns whether anything changed.
+
+        New labels go into copies of the dictionaries, so queries still
+        reading the previous snapshot never see them change.
+        """
+        with self.refresh_lock:
+            current = self.cube.partitions if self.cube is not None else {}
+            dictionaries = {dimension: dictionary.copy() for dimension, dictionary in self.dictionaries.items()}
+            partitions, rebuilt = {}, []
+            for key, paths in sorted(self.partition_plan().items()):
+                if paths is None:
+                    if key in current:
+                        partitions[key] = current[key]
+                    continue
+                files = tuple((path, self.fingerprint(path)) for path in paths)
+                previous = current.get(key)
+                if previous is not None and previous.files == files:
+                    partitions[key] = previous
+                    continue
+                partitions[key] = CurPartition.from_files(paths, dictionaries, files)
+                rebuilt.append(key)
+            removed = sorted(current.keys() - partitions.keys())
+            referenced = {path for partition in partitions.values() for path, _ in partition.files}
+            self.fingerprints = {path: known for path, known in self.fingerprints.items() if path in referenced}
+            self.last_refresh = {'rebuilt': rebuilt, 'removed': removed, 'partitions': len(partitions)}
+            if self.cube is not None and not rebuilt and not removed:
+                return False
+            partitions, dictionaries = self.compact_dictionaries(partitions, dictionaries)
+            self.dictionaries = dictionaries
+            self.cube = CurCube(partitions, dictionaries)
+            self.ingested_at = datetime.now(timezone.utc)
+        response_etags.clear()
+        return True
+
+    def ingest(self) -> bool:
+        try:
+            changed = self.refresh()
+        except Exception as e:
+            # Keep serving the previous snapshot, if there is one
+            self.error = str(e)
+            raise
+        self.error = None
+        return changed
+
+    def stats(self) -> Dict:
+        cube = self.cube
+        return {
+            'partitions': len(cube.partitions) if cube is not None else 0,
+            'ingested_at': self.ingested_at.isoformat() if self.ingested_at else None,
+            'last_refresh': self.last_refresh,
+            'error': self.error
+        }
+
+    def ready_cube(self) -> CurCube:
+        cube = self.cube
+        if cube is None:
+            if self.error:
+                raise HTTPException(status_code=500, detail=f"CUR ingestion failed: {self.error}")
+            raise HTTPException(status_code=503, detail="CUR ingestion is still in progress")
+        return cube
+
+    async def iter_pages(self, query: Dict):
+        cube = self.ready_cube()
+        loop = asyncio.get_running_loop()
+        yield await loop.run_in_executor(None, cube.results_by_time, query)
+
+    async def group_totals(self, query: Dict) -> Dict[Tuple[str, ...], float]:
+        cube = self.ready_cube()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, cube.group_totals, query)
+
+    async def forecast(self, query: Dict) -> Dict:
+        return await local_forecast(self, query)
+
+cost_source = CurSource(CUR_DIRECTORY) if COST_DATA_SOURCE == 'cur' else CostExplorerSource()
+
+CHART_COLORS = ['rgb(255, 99, 132)', 'rgb(54, 162, 235)', 'rgb(255, 205, 86)', 
+                'rgb(75, 192, 192)', 'rgb(153, 102, 255)', 'rgb(255, 159, 64)']
+
+class CostMatrix:
+    """
+    Dense (period x group) matrix of one metric (BlendedCost by default) with
+    dictionary-encoded group labels. Periods are sorted by start date.
+    """
+
+    def __init__(self, periods: List[Tuple[str, str]], groups: List[str], costs: np.ndarray,
+                 present: np.ndarray, currency: str):
+        self.periods = periods
+        self.groups = groups
+        self.costs = costs
+        self.present = present
+        self.currency = currency
+
+class CostMatrixBuilder:
+    """
+    Collects ResultsByTime pages into flat code/amount arrays, then builds
+    the CostMatrix in one vectorized pass instead of a dict per row
+    """
+
+    def __init__(self, grouped: bool, metric: str = 'BlendedCost'):
+        self.grouped = grouped
+        self.metric = metric
+        self.currency = "USD"
+        self._periods = {}  # start -> (index, end)
+        self._groups = {}  # label -> code
+        self._period_codes = []  # one entry per run of cells from the same period
+        self._period_sizes = []
+        self._group_codes = []
+        self._amounts = []
+
+    def add_results(self, results: List[Dict]):
+        periods = self._periods
+        groups = self._groups
+        add_group_code = self._group_codes.append
+        add_amount = self._amounts.append
+        metric = self.metric
+        for result in results:
+            start = result['TimePeriod']['Start']
+            period = periods.get(start)
+            if period is None:
+                period = periods[start] = (len(periods), result['TimePeriod']['End'])
+            if self.grouped:
+                cells = result['Groups']
+                for group in cells:
+                    key = group['Keys'][0] if group['Keys'] else 'Unknown'
+                    code = groups.get(key)
+                    if code is None:
+                        code = groups[key] = len(groups)
+                    add_group_code(code)
+                    add_amount(group['Metrics'][metric]['Amount'])
+                if cells:
+                    self.currency = cells[-1]['Metrics'][metric]['Unit']
+                size = len(cells)
+            elif metric in result['Total']:
+                add_group_code(0)
+                add_amount(result['Total'][metric]['Amount'])
+                self.currency = result['Total'][metric]['Unit']
+                size = 1
+            else:
+                size = 0
+            self._period_codes.append(period[0])
+            self._period_sizes.append(size)
+
+    def build(self) -> CostMatrix:
+        starts = sorted(self._periods)
+        order = np.empty(len(starts), dtype=np.int64)
+        order[[self._periods[start][0] for start in starts]] = np.arange(len(starts))
+        groups = list(self._groups) if self.grouped else ['Cost']
+
+        rows = np.repeat(order[np.asarray(self._period_codes, dtype=np.int64)], self._period_sizes)
+        cols = np.asarray(self._group_codes, dtype=np.int64)
+        costs = np.zeros((len(starts), len(groups)), dtype=np.float64)
+        present = np.zeros((len(starts), len(groups)), dtype=bool)
+        costs[rows, cols] = np.asarray(self._amounts, dtype=np.float64)
+        present[rows, cols] = True
+
+        periods = [(start, self._periods[start][1]) for start in starts]
+        return CostMatrix(periods, groups, costs, present, self.currency)
+
+    def build_table(self):
+        """
+        Build a pyarrow Table with one row per CE cell, in arrival order.
+        Period, group and currency columns are dictionary-encoded from the
+        collected codes and cost is float64, so no row dicts are created.
+        """
+        starts = list(self._periods)
+        ends = [self._periods[start][1] for start in starts]
+        period_index = pa.array(
+            np.repeat(np.asarray(self._period_codes, dtype=np.int32), self._period_sizes), type=pa.int32()
+        )
+        costs = np.asarray(self._amounts, dtype=np.float64)
+        columns = {
+            'period_start': pa.DictionaryArray.from_arrays(period_index, pa.array(starts, type=pa.string())),
+            'period_end': pa.DictionaryArray.from_arrays(period_index, pa.array(ends, type=pa.string()))
+        }
+        if self.grouped:
+            columns['group'] = pa.DictionaryArray.from_arrays(
+                pa.array(np.asarray(self._group_codes, dtype=np.int32), type=pa.int32()),
+                pa.array(list(self._groups), type=pa.string())
+            )
+        columns['cost'] = pa.array(costs, type=pa.float64())
+        columns['currency'] = pa.DictionaryArray.from_arrays(
+            pa.array(np.zeros(len(costs), dtype=np.int32), type=pa.int32()), pa.array([self.currency], type=pa.string())
         )
+        table = pa.table(columns)
+        return table.replace_schema_metadata({
+            'total_cost': str(round(float(costs.sum()), 2)),
+            'currency': self.currency
+        })
+
+def summarize_cost_matrix(matrix: CostMatrix, grouped: bool) -> Dict:
+    """
+    Compute total, row data and chart data for a CostResponse from the matrix
+    """
+    currency = matrix.currency
+    labels = np.array(matrix.groups, dtype=object)
+    data = []
+    for (start, end), present, costs in zip(matrix.periods, matrix.present, matrix.costs):
+        codes = np.flatnonzero(present)
+        if grouped:
+            data.extend([
+                {'period_start': start, 'period_end': end, 'group': group_name, 'cost': cost, 'currency': currency}
+                for group_name, cost in zip(labels[codes].tolist(), costs[codes].tolist())
+            ])
+        else:
+            data.extend([
+                {'period_start': start, 'period_end': end, 'cost': cost, 'currency': currency}
+                for cost in costs[codes].tolist()
+            ])
+
+    if grouped:
+        # Every series is a zero-filled column of the grid, aligned with the shared label axis
+        datasets = []
+        for i, (group_name, series) in enumerate(zip(matrix.groups, matrix.costs.T.tolist())):
+            color = CHART_COLORS[i % len(CHART_COLORS)]
+            datasets.append({
+                'label': group_name,
+                'data': series,
+                'borderColor': color,
+                'backgroundColor': color.replace('rgb', 'rgba').replace(')', ', 0.2)')
+            })
+        chart_data = {'labels': [start for start, _ in matrix.periods], 'datasets': datasets}
+    else:
+        present = matrix.present[:, 0]
+        chart_data = {
+            'labels': [start for (start, _), has_cost in zip(matrix.periods, present.tolist()) if has_cost],
+            'datasets': [{
+                'label': 'Cost',
+                'data': matrix.costs[present, 0].tolist(),
+                'borderColor': 'rgb(75, 192, 192)',
+                'backgroundColor': 'rgba(75, 192, 192, 0.2)'
+            }]
+        }
+
+    return {
+        'total_cost': round(float(matrix.costs.sum()), 2),
+        'currency': currency,
+        'data': data,
+        'chart_data': chart_data
+    }
+
+ARROW_STREAM_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+PARQUET_MEDIA_TYPES = ('application/vnd.apache.parquet', 'application/x-parquet')
+
+def columnar_media_type(http_request: Request) -> Optional[str]:
+    """
+    Return the Arrow IPC or Parquet media type the client asked for, if any
+    """
+    accept = http_request.headers.get('accept', '')
+    for media_type in (ARROW_STREAM_MEDIA_TYPE,) + PARQUET_MEDIA_TYPES:
+        if media_type in accept:
+            if pa is None:
+                raise HTTPException(status_code=406, detail="Arrow and Parquet responses require pyarrow to be installed")
+            return media_type
+    return None
+
+def table_bytes(table, media_type: str) -> bytes:
+    sink = pa.BufferOutputStream()
+    if media_type == ARROW_STREAM_MEDIA_TYPE:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, sink)
+    return sink.getvalue().to_pybytes()
+
+# Content digests of recent cost responses, keyed by endpoint, CE query and
+# media type, kept only as long as the CE data behind them stays fresh
+response_etags = QueryCache()
+
+def response_key(endpoint: str, query: Dict, **params) -> str:
+    return json.dumps({'endpoint': endpoint, 'query': query, 'params': params}, sort_keys=True)
+
+def negotiate_encoding(request: Request, size: int) -> Optional[str]:
+    if size < RESPONSE_COMPRESS_MIN_SIZE:
+        return None
+    accept_encoding = request.headers.get('accept-encoding', '')
+    if brotli is not None and 'br' in accept_encoding:
+        return 'br'
+    if 'gzip' in accept_encoding:
+        return 'gzip'
+    return None
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL)
+
+async def gzip_stream(chunks):
+    """
+    Gzip a streamed body chunk by chunk, flushing after each one so the
+    client can decode every row as soon as it is sent. GZipMiddleware
+    would keep rows in zlib's buffer until its window fills.
+    """
+    compressor = zlib.compressobj(RESPONSE_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+def make_etag(digest: str, encoding: Optional[str]) -> str:
+    # Each content encoding is its own representation, so it gets its own strong ETag
+    return f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get('if-none-match', '')
+    return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+def not_modified_response(request: Request, key: str) -> Optional[Response]:
+    """
+    Answer a conditional request with 304 straight from the ETag index,
+    without touching Cost Explorer, when its ETag is still current
+    """
+    if 'if-none-match' not in request.headers:
+        return None
+    entry = response_etags.get(key)
+    if entry is None:
+        return None
+    digest, size = entry
+    etag = make_etag(digest, negotiate_encoding(request, size))
+    if not etag_matches(request, etag):
+        return None
+    return Response(status_code=304, headers={'ETag': etag, 'Vary': 'Accept-Encoding'})
+
+def etag_ttl(ttl: int) -> float:
+    """
+    How long a response's ETag may answer 304s: no longer than the cached
+    CE data it was built from stays fresh, so once that data is refreshed
+    a revalidating client gets the new body
+    """
+    staleness = ce_staleness.get()
+    if staleness is None:
+        return ttl
+    return min(ttl, staleness.get('expires_in', ttl))
+
+def stale_headers() -> Dict[str, str]:
+    """
+    Headers marking a response built from stale cache entries
+    """
+    staleness = ce_staleness.get()
+    return {'X-Cache': 'STALE'} if staleness and staleness['stale'] else {}
+
+async def cost_body_response(request: Request, body: bytes, media_type: str, key: str, ttl: int) -> Response:
+    """
+    Send a cost response body with a strong content-hash ETag, compressed
+    with brotli or gzip when the client accepts it. Stale bodies are marked
+    with X-Cache: STALE and kept out of the ETag index, so the refreshed
+    result replaces them on the next request.
+    """
+    digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+    headers = stale_headers()
+    if not headers:
+        response_etags.set(key, (digest, len(body)), etag_ttl(ttl))
+    encoding = negotiate_encoding(request, len(body))
+    headers.update({'ETag': make_etag(digest, encoding), 'Vary': 'Accept-Encoding'})
+    if etag_matches(request, headers['ETag']):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        loop = asyncio.get_running_loop()
+        body = await loop.run_in_executor(None, compress_body, body, encoding)
+        headers['Content-Encoding'] = encoding
+    return Response(body, media_type=media_type, headers=headers)
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+def wants_ndjson(request: CostRequest, http_request: Request) -> bool:
+    return request.stream or NDJSON_MEDIA_TYPE in http_request.headers.get('accept', '')
+
+async def stream_cost_rows(pages, first_results: List[Dict], grouped: bool):
+    """
+    Encode CostResponse data rows as NDJSON, one chunk per CE page, followed
+    by a trailer record with the totals. Only the current page is held in
+    memory, however long the date range.
+    """
+    total_cost = 0.0
+    currency = "USD"
+    rows = 0
+    results = first_results
+    try:
+        while results is not None:
+            lines = []
+            for result in results:
+                period_start = result['TimePeriod']['Start']
+                period_end = result['TimePeriod']['End']
+                cells = result['Groups'] if grouped else [result] if 'BlendedCost' in result['Total'] else []
+                for cell in cells:
+                    blended = cell['Metrics']['BlendedCost'] if grouped else cell['Total']['BlendedCost']
+                    cost = float(blended['Amount'])
+                    currency = blended['Unit']
+                    total_cost += cost
+                    row = {'period_start': period_start, 'period_end': period_end}
+                    if grouped:
+                        row['group'] = cell['Keys'][0] if cell['Keys'] else 'Unknown'
+                    row['cost'] = cost
+                    row['currency'] = currency
+                    lines.append(orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE))
+            rows += len(lines)
+            if lines:
+                yield b''.join(lines)
+            try:
+                results = await pages.__anext__()
+            except StopAsyncIteration:
+                results = None
+    except Exception as e:
+        # Headers are already sent, so report the failure in-band
+        yield orjson.dumps({'type': 'error', 'detail': str(e)}, option=orjson.OPT_APPEND_NEWLINE)
+        return
+    finally:
+        await pages.aclose()
+    yield orjson.dumps(
+        {'type': 'trailer', 'total_cost': round(total_cost, 2), 'currency': currency, 'rows': rows},
+        option=orjson.OPT_APPEND_NEWLINE
+    )
+
+def ranking_group_by(dimension: str) -> Dict:
+    """
+    GroupBy entry for a ranking dimension: a Cost Explorer dimension such
+    as SERVICE or USAGE_TYPE, or 'tag:<key>' for a cost allocation tag
+    """
+    if dimension.lower().startswith('tag:') and len(dimension) > 4:
+        return {'Type': 'TAG', 'Key': dimension[4:]}
+    if not re.fullmatch(r'[A-Z_]+', dimension):
+        raise HTTPException(status_code=400, detail=f"Invalid dimension: {dimension}")
+    return {'Type': 'DIMENSION', 'Key': dimension}
+
+def group_label(group_by: Dict, key: str) -> str:
+    if group_by['Type'] == 'TAG':
+        # Cost Explorer returns tag groups as 'key$value', with an empty value for untagged spend
+        return key.split('$', 1)[-1] or 'Untagged'
+    return key or 'Unknown'
+
+async def accumulate_group_totals(pages, query: Dict) -> Dict[Tuple[str, ...], float]:
+    """
+    Exact per-group totals of the first metric across all pages and periods
+    """
+    metric = query['Metrics'][0]
+    group_by = query.get('GroupBy', [])
+    totals = {}
+    async for results in pages:
+        for result in results:
+            for group in result['Groups']:
+                key = tuple(group_label(definition, label) for definition, label in zip(group_by, group['Keys']))
+                totals[key] = totals.get(key, 0.0) + float(group['Metrics'][metric]['Amount'])
+    return totals
+
+def rank_totals(totals: Dict[str, float], limit: int) -> Dict:
+    """
+    Top `limit` keys by cost, with the remaining keys folded into an Other
+    bucket. heapq.nlargest keeps this O(n log limit) however many keys there are.
+    """
+    top = heapq.nlargest(max(limit, 0), totals.items(), key=lambda x: x[1])
+    total_cost = math.fsum(totals.values())
+    return {
+        'top': [{'key': key, 'cost': round(cost, 2)} for key, cost in top],
+        'other': {'count': len(totals) - len(top), 'cost': round(total_cost - math.fsum(cost for _, cost in top), 2)},
+        'total_cost': round(total_cost, 2),
+        'total_keys': len(totals)
+    }
+
+def rank_nested_totals(totals: Dict[Tuple[str, str], float], limit: int, parent_limit: int) -> Dict:
+    """
+    Top `parent_limit` parents by cost and, within each, the top `limit`
+    children with their own Other bucket
+    """
+    children = {}
+    for (parent, child), cost in totals.items():
+        children.setdefault(parent, {})[child] = cost
+    ranking = rank_totals({parent: math.fsum(costs.values()) for parent, costs in children.items()}, parent_limit)
+    for entry in ranking['top']:
+        nested = rank_totals(children[entry['key']], limit)
+        entry.update(top=nested['top'], other=nested['other'], total_keys=nested['total_keys'])
+    return ranking
+
+def ranking_column(dimension: str) -> str:
+    """
+    Columnar output name for a ranking dimension, e.g. 'service' or 'tag_team'
+    """
+    return re.sub(r'\W+', '_', dimension).lower()
+
+def ranking_table(ranking: Dict, dimension: str, parent: Optional[str]):
+    """
+    Flatten a ranking into an Arrow table; nested rankings get one row per
+    child, plus an 'Other' row for each parent with children left out
+    """
+    parents, keys, costs = [], [], []
+    for entry in ranking['top']:
+        if parent is None:
+            keys.append(entry['key'])
+            costs.append(entry['cost'])
+            continue
+        for child in entry['top'] + ([{'key': 'Other', 'cost': entry['other']['cost']}] if entry['other']['count'] else []):
+            parents.append(entry['key'])
+            keys.append(child['key'])
+            costs.append(child['cost'])
+    columns = {}
+    if parent is not None:
+        columns[ranking_column(parent)] = pa.array(parents, type=pa.string()).dictionary_encode()
+    columns[ranking_column(dimension)] = pa.array(keys, type=pa.string()).dictionary_encode()
+    columns['cost'] = pa.array(costs, type=pa.float64())
+    return pa.table(columns)
+
+def services_query(days: int, group_by: List[Dict]) -> Dict:
+    """
+    MONTHLY BlendedCost query over the last `days` days, as ranked by /costs/services
+    """
+    end_date = datetime.now(timezone.utc)
+    start_date = end_date - timedelta(days=days)
+    return {
+        'TimePeriod': {
+            'Start': start_date.strftime('%Y-%m-%d'),
+            'End': end_date.strftime('%Y-%m-%d')
+        },
+        'Granularity': 'MONTHLY',
+        'Metrics': ['BlendedCost'],
+        'GroupBy': group_by
+    }
+
+class Leaderboard:
+    """
+    Every service of one window ranked by cost, with running totals so a
+    top-k and its Other bucket are read off in O(limit)
+    """
+
+    def __init__(self, days: int, query: Dict, totals: Dict[str, float]):
+        ranked = sorted(totals.items(), key=lambda x: x[1], reverse=True)
+        self.days = days
+        self.query = query
+        self.keys = [key for key, _ in ranked]
+        self.costs = [cost for _, cost in ranked]
+        self.running = [0.0] + list(itertools.accumulate(self.costs))
+        self.total_cost = math.fsum(self.costs)
+        self.as_of = datetime.now(timezone.utc)
+
+    def ranking(self, limit: int) -> Dict:
+        count = min(max(limit, 0), len(self.keys))
+        return {
+            'top': [{'key': self.keys[i], 'cost': round(self.costs[i], 2)} for i in range(count)],
+            'other': {'count': len(self.keys) - count, 'cost': round(self.total_cost - self.running[count], 2)},
+            'total_cost': round(self.total_cost, 2),
+            'total_keys': len(self.keys)
+        }
+
+class Leaderboards:
+    """
+    Background refresher of the service leaderboards for the standard
+    windows. Rebuilds run at background priority every
+    LEADERBOARD_REFRESH_INTERVAL seconds, or right away after wake(), and
+    each finished board replaces the old one in a single assignment.
+    """
+
+    def __init__(self, windows: List[int]):
+        self.windows = windows
+        self.boards = {}
+        self.errors = {}
+        self.refreshes = 0
+        self._wake = None
+
+    def get(self, days: int) -> Optional[Leaderboard]:
+        board = self.boards.get(days)
+        if board is None or (datetime.now(timezone.utc) - board.as_of).total_seconds() > LEADERBOARD_MAX_AGE:
+            return None
+        return board
+
+    async def refresh(self):
+        # Boards are stamped with the time they are built, so they are built from fresh data
+        token = ce_priority.set(PRIORITY_BACKGROUND)
+        bypass_token = ce_bypass_cache.set(True)
+        try:
+            for days in self.windows:
+                query = services_query(days, [{'Type': 'DIMENSION', 'Key': 'SERVICE'}])
+                try:
+                    totals = await cost_source.group_totals(query)
+                except Exception as e:
+                    # Keep serving the previous board until it ages out
+                    self.errors[days] = str(getattr(e, 'detail', e))
+                    continue
+                self.boards[days] = Leaderboard(days, query, {group[0]: cost for group, cost in totals.items()})
+                self.errors.pop(days, None)
+            self.refreshes += 1
+        finally:
+            ce_bypass_cache.reset(bypass_token)
+            ce_priority.reset(token)
+
+    def wake(self):
+        """
+        Rebuild now, e.g. after new cost data was ingested
+        """
+        if self._wake is not None:
+            self._wake.set()
+
+    async def run(self):
+        self._wake = asyncio.Event()
+        while True:
+            await self.refresh()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=LEADERBOARD_REFRESH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def stats(self) -> Dict:
+        return {
+            'windows': {days: board.as_of.isoformat() for days, board in sorted(self.boards.items())},
+            'errors': self.errors,
+            'refreshes': self.refreshes
+        }
+
+leaderboards = Leaderboards(LEADERBOARD_WINDOWS)
+
+# What the dashboard requests on load: the last 30 days by day, and the top 10 services over 30 days
+DASHBOARD_WARMUP_QUERIES = [
+    {'endpoint': 'analyze', 'days': 30, 'granularity': 'DAILY'},
+    {'endpoint': 'services', 'days': 30}
+]
+
+class CacheWarmup:
+    """
+    Prefetches hot queries at background priority after startup, so the
+    first dashboard visit after a deploy hits a warm cache. Entries are the
+    dashboard defaults plus any listed in CACHE_WARMUP_FILE, e.g.
+    {"endpoint": "analyze", "days": 90, "granularity": "MONTHLY", "group_by": "SERVICE"}
+    or {"endpoint": "services", "days": 7, "dimension": "REGION"}.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = list(DASHBOARD_WARMUP_QUERIES)
+        self.errors = []
+        self.warmed = 0
+        self.done = False
+        self.finished_at = None
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as warmup_file:
+                self.entries.extend(json.load(warmup_file))
+        except (OSError, ValueError) as e:
+            self.errors.append({'entry': self.path, 'error': str(e)})
+
+    async def warm(self, entry: Dict):
+        days = int(entry.get('days', 30))
+        if entry.get('endpoint') == 'analyze':
+            # The dashboard sends UTC dates (Date.toISOString)
+            today = datetime.now(timezone.utc).date()
+            request = CostRequest(
+                start_date=entry.get('start_date', (today - timedelta(days=days)).isoformat()),
+                end_date=entry.get('end_date', today.isoformat()),
+                granularity=entry.get('granularity', 'DAILY'),
+                group_by=entry.get('group_by')
+            )
+            async for _ in cost_source.iter_pages(analyze_query(request)):
+                pass
+        elif entry.get('endpoint') == 'services':
+            group_by = [ranking_group_by(entry.get('dimension', 'SERVICE'))]
+            if entry.get('parent'):
+                group_by.insert(0, ranking_group_by(entry['parent']))
+            await cost_source.group_totals(services_query(days, group_by))
+        else:
+            raise ValueError(f"Unknown warm-up endpoint: {entry.get('endpoint')}")
+
+    async def run(self):
+        ce_priority.set(PRIORITY_BACKGROUND)
+        self.load()
+        for entry in self.entries:
+            try:
+                await self.warm(entry)
+                self.warmed += 1
+            except Exception as e:
+                self.errors.append({'entry': entry, 'error': str(getattr(e, 'detail', e))})
+        self.done = True
+        self.finished_at = datetime.now(timezone.utc)
+
+    def status(self) -> Dict:
+        return {
+            'done': self.done,
+            'queries': len(self.entries),
+            'warmed': self.warmed,
+            'errors': self.errors,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+cache_warmup = CacheWarmup(CACHE_WARMUP_FILE)
+
+@app.on_event("startup")
+async def init_cost_explorer_client():
+    ce_client_manager.get_client()
+
+async def refresh_cur_periodically(source: CurSource):
+    """
+    Ingest in the background so the API is up while reports are parsed,
+    then pick up rewritten reports every CUR_REFRESH_INTERVAL seconds
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            if await loop.run_in_executor(None, source.ingest):
+                leaderboards.wake()
+        except Exception:
+            pass  # Recorded in source.error; retried on the next pass
+        if CUR_REFRESH_INTERVAL <= 0:
+            return
+        await asyncio.sleep(CUR_REFRESH_INTERVAL)
+
+cur_refresh_task = None
+leaderboard_task = None
+warmup_task = None
+
+@app.on_event("startup")
+async def start_cur_ingestion():
+    global cur_refresh_task
+    if isinstance(cost_source, CurSource):
+        cur_refresh_task = asyncio.create_task(refresh_cur_periodically(cost_source))
+
+@app.on_event("startup")
+async def start_leaderboards():
+    global leaderboard_task
+    if LEADERBOARD_WINDOWS and LEADERBOARD_REFRESH_INTERVAL > 0:
+        leaderboard_task = asyncio.create_task(leaderboards.run())
+
+@app.on_event("startup")
+async def start_cache_warmup():
+    global warmup_task
+    # The CUR source answers from memory, so there is no cache to warm
+    if CACHE_WARMUP and not isinstance(cost_source, CurSource):
+        warmup_task = asyncio.create_task(cache_warmup.run())
+    else:
+        cache_warmup.done = True
+
+@app.on_event("shutdown")
+async def shutdown_ce_executor():
+    global cost_store
+    ce_executor.shutdown(wait=False)
+    if cost_store is not None:
+        cost_store.close()
+        cost_store = None
+    for task in (cur_refresh_task, leaderboard_task, warmup_task):
+        if task is not None:
+            task.cancel()
 
 @app.get("/")
 async def root():
@@ -40,173 +2685,295 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    ready = cache_warmup.done and not (isinstance(cost_source, CurSource) and cost_source.cube is None)
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "data_source": cost_source.name,
+        "ready": ready,
+        "warmup": cache_warmup.status()
+    }
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "cache": await query_cache.run_backend(query_cache.stats),
+        "single_flight": ce_single_flight.stats(),
+        "rate_limiter": ce_rate_limiter.stats(),
+        "derived_queries": derivation_stats,
+        "accounts": {name: account.stats() for name, account in ce_accounts.items()},
+        "cur": cost_source.stats() if isinstance(cost_source, CurSource) else None,
+        "leaderboards": leaderboards.stats()
+    }
+
+def analyze_query(request: CostRequest) -> Dict:
+    """
+    Validate a CostRequest and build its GetCostAndUsage query
+    """
+    # Validate dates
+    start_date = datetime.fromisoformat(request.start_date.replace('Z', '+00:00'))
+    end_date = datetime.fromisoformat(request.end_date.replace('Z', '+00:00'))
+    
+    if start_date >= end_date:
+        raise HTTPException(status_code=400, detail="Start date must be before end date")
+    
+    # Build the query
+    query = {
+        'TimePeriod': {
+            'Start': start_date.strftime('%Y-%m-%d'),
+            'End': end_date.strftime('%Y-%m-%d')
+        },
+        'Granularity': request.granularity,
+        'Metrics': list(ANALYZE_METRICS)
+    }
+    
+    # Add group by if specified
+    if request.group_by:
+        query['GroupBy'] = [{'Type': 'DIMENSION', 'Key': request.group_by}]
+    return query
 
 @app.post("/costs/analyze", response_model=CostResponse)
-async def analyze_costs(request: CostRequest):
+async def analyze_costs(request: CostRequest, http_request: Request):
     """
     Analyze AWS costs for a given time period
     """
     try:
-        ce_client = get_cost_explorer_client()
-        
-        # Validate dates
-        start_date = datetime.fromisoformat(request.start_date.replace('Z', '+00:00'))
-        end_date = datetime.fromisoformat(request.end_date.replace('Z', '+00:00'))
+        ce_deadline.set(time.monotonic() + CE_REQUEST_DEADLINE)
+        ce_staleness.set({'stale': False})
+        query = analyze_query(request)
         
-        if start_date >= end_date:
-            raise HTTPException(status_code=400, detail="Start date must be before end date")
-        
-        # Build the query
-        query = {
-            'TimePeriod': {
-                'Start': start_date.strftime('%Y-%m-%d'),
-                'End': end_date.strftime('%Y-%m-%d')
-            },
-            'Granularity': request.granularity,
-            'Metrics': ['BlendedCost', 'UnblendedCost', 'UsageQuantity']
-        }
+        if wants_ndjson(request, http_request):
+            # Pages are bounded per CE call rather than by one deadline for the whole export.
+            # Cleared before the first page, since the shard tasks it starts copy the deadline.
+            ce_deadline.set(None)
+            # Fetch the first page up front so CE errors still map to HTTP status codes
+            pages = cost_source.iter_pages(query)
+            try:
+                first_results = await pages.__anext__()
+            except StopAsyncIteration:
+                first_results = []
+            body = stream_cost_rows(pages, first_results, bool(request.group_by))
+            headers = stale_headers()
+            if 'gzip' in http_request.headers.get('accept-encoding', ''):
+                body = gzip_stream(body)
+                headers.update({'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+            return StreamingResponse(body, media_type=NDJSON_MEDIA_TYPE, headers=headers)
         
-        # Add group by if specified
-        if request.group_by:
-            query['GroupBy'] = [{'Type': 'DIMENSION', 'Key': request.group_by}]
+        media_type = columnar_media_type(http_request) or 'application/json'
+        key = response_key('analyze', query, media_type=media_type)
+        not_modified = not_modified_response(http_request, key)
+        if not_modified:
+            return not_modified
         
-        # Get cost data
-        response = ce_client.get_cost_and_usage(**query)
+        # Collect every page into flat code and amount arrays
+        builder = CostMatrixBuilder(grouped=bool(request.group_by))
+        async for results in cost_source.iter_pages(query):
+            builder.add_results(results)
         
-        # Process the response
-        total_cost = 0.0
-        currency = "USD"
-        data = []
-        chart_data = {"labels": [], "datasets": []}
+        if media_type != 'application/json':
+            body = table_bytes(builder.build_table(), media_type)
+        else:
+            # The summary is built here and already matches CostResponse, so skip
+            # response_model re-validation and encode it straight to JSON
+            body = orjson.dumps(summarize_cost_matrix(builder.build(), bool(request.group_by)))
+        return await cost_body_response(http_request, body, media_type, key, query_ttl(query))
         
-        for result in response['ResultsByTime']:
-            period_start = result['TimePeriod']['Start']
-            period_end = result['TimePeriod']['End']
-            
-            if result['Groups']:
-                # Grouped data
-                for group in result['Groups']:
-                    group_key = group['Keys'][0] if group['Keys'] else 'Unknown'
-                    cost = float(group['Metrics']['BlendedCost']['Amount'])
-                    total_cost += cost
-                    currency = group['Metrics']['BlendedCost']['Unit']
-                    
-                    data.append({
-                        'period_start': period_start,
-                        'period_end': period_end,
-                        'group': group_key,
-                        'cost': cost,
-                        'currency': currency
-                    })
-            else:
-                # Non-grouped data
-                cost = float(result['Total']['BlendedCost']['Amount'])
-                total_cost += cost
-                currency = result['Total']['BlendedCost']['Unit']
-                
-                data.append({
-                    'period_start': period_start,
-                    'period_end': period_end,
-                    'cost': cost,
-                    'currency': currency
-                })
-                
-                chart_data['labels'].append(period_start)
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Cost Explorer request deadline exceeded")
+    except ClientError as e:
+        if is_throttling_error(e):
+            raise HTTPException(status_code=429, detail=f"AWS Cost Explorer is throttling requests: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"AWS API Error: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
+
+def select_accounts(names: Optional[List[str]]) -> List[CostAccount]:
+    """
+    Resolve requested account names against CE_ACCOUNTS (all of them by default)
+    """
+    if not ce_accounts:
+        raise HTTPException(status_code=400, detail="No accounts configured; set CE_ACCOUNTS")
+    if not names:
+        return list(ce_accounts.values())
+    unknown = [name for name in names if name not in ce_accounts]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown accounts: {', '.join(unknown)}")
+    return [ce_accounts[name] for name in dict.fromkeys(names)]
+
+def linked_account_query(query: Dict) -> Dict:
+    """
+    The query with LINKED_ACCOUNT as its first GroupBy, so each account's
+    results carry the account ID they belong to
+    """
+    return dict(query, GroupBy=[{'Type': 'DIMENSION', 'Key': 'LINKED_ACCOUNT'}] + query.get('GroupBy', []))
+
+async def fan_out_accounts(accounts: List[CostAccount], query: Dict) -> Dict[str, object]:
+    """
+    Run a GetCostAndUsage query against every account, at most
+    CE_ACCOUNT_CONCURRENCY at a time. Maps each account name to its
+    ResultsByTime, or to the exception its query failed with.
+    """
+    pool = asyncio.Semaphore(CE_ACCOUNT_CONCURRENCY)
+    query = linked_account_query(query)
+
+    async def collect(account: CostAccount) -> List[Dict]:
+        # gather runs this in its own task, so the account stays out of the request's context
+        async with pool:
+            ce_account.set(account)
+            return [result async for results in iter_cost_pages(query) for result in results]
+
+    outcomes = await asyncio.gather(*[collect(account) for account in accounts], return_exceptions=True)
+    return {account.name: outcome for account, outcome in zip(accounts, outcomes)}
+
+def account_results(name: str, results: List[Dict], grouped: bool, labels: Dict[str, Tuple[str, str]]) -> List[Dict]:
+    """
+    Relabel one account's ResultsByTime, grouped by LINKED_ACCOUNT (then by
+    the request's group_by), as groups labelled with the configured account
+    name and ID. Records each label's (name, account ID) in labels.
+    """
+    relabeled = []
+    for result in results:
+        groups = []
+        for group in result['Groups']:
+            keys = group['Keys'] or ['Unknown']
+            label = f"{name} ({keys[0]})"
+            if grouped:
+                label = f"{label} / {keys[1] if len(keys) > 1 else 'Unknown'}"
+            labels[label] = (name, keys[0])
+            groups.append({'Keys': [label], 'Metrics': group['Metrics']})
+        relabeled.append({'TimePeriod': result['TimePeriod'], 'Groups': groups})
+    return relabeled
+
+def account_error(error: BaseException) -> str:
+    if isinstance(error, HTTPException):
+        return error.detail
+    if isinstance(error, asyncio.TimeoutError):
+        return "Cost Explorer request deadline exceeded"
+    return str(error) or type(error).__name__
+
+@app.post("/costs/accounts", response_model=CostResponse)
+async def analyze_account_costs(request: AccountsCostRequest):
+    """
+    Analyze costs across the configured member accounts, grouped by account.
+    Accounts whose queries fail are listed under accounts.failed; the request
+    only fails when every account does.
+    """
+    try:
+        ce_deadline.set(time.monotonic() + CE_REQUEST_DEADLINE)
+        ce_staleness.set({'stale': False})
+        if not isinstance(cost_source, CostExplorerSource):
+            raise HTTPException(status_code=400, detail="Multi-account queries need COST_DATA_SOURCE=cost_explorer")
+        accounts = select_accounts(request.accounts)
+        query = analyze_query(request)
         
-        # Prepare chart data
-        if not request.group_by:
-            # Simple line chart data
-            chart_data['datasets'] = [{
-                'label': 'Cost',
-                'data': [item['cost'] for item in data],
-                'borderColor': 'rgb(75, 192, 192)',
-                'backgroundColor': 'rgba(75, 192, 192, 0.2)'
-            }]
-        else:
-            # Grouped chart data
-            groups = {}
-            for item in data:
-                group_name = item.get('group', 'Unknown')
-                if group_name not in groups:
-                    groups[group_name] = []
-                groups[group_name].append(item['cost'])
-            
-            chart_data['datasets'] = []
-            colors = ['rgb(255, 99, 132)', 'rgb(54, 162, 235)', 'rgb(255, 205, 86)', 
-                     'rgb(75, 192, 192)', 'rgb(153, 102, 255)', 'rgb(255, 159, 64)']
-            
-            for i, (group_name, costs) in enumerate(groups.items()):
-                chart_data['datasets'].append({
-                    'label': group_name,
-                    'data': costs,
-                    'borderColor': colors[i % len(colors)],
-                    'backgroundColor': colors[i % len(colors)].replace('rgb', 'rgba').replace(')', ', 0.2)')
-                })
+        outcomes = await fan_out_accounts(accounts, query)
+        failed = {name: outcome for name, outcome in outcomes.items() if isinstance(outcome, BaseException)}
+        if len(failed) == len(outcomes):
+            raise next(iter(failed.values()))
         
-        return CostResponse(
-            total_cost=round(total_cost, 2),
-            currency=currency,
-            data=data,
-            chart_data=chart_data
-        )
+        builder = CostMatrixBuilder(grouped=True)
+        labels = {}  # group label -> (account name, account ID)
+        for name, outcome in outcomes.items():
+            if name not in failed:
+                builder.add_results(account_results(name, outcome, bool(request.group_by), labels))
+        content = summarize_cost_matrix(builder.build(), grouped=True)
+        for row in content['data']:
+            row['account'], row['account_id'] = labels[row['group']]
+        account_ids = {}
+        for name, account_id in labels.values():
+            account_ids.setdefault(name, set()).add(account_id)
+        content['accounts'] = {
+            'succeeded': [{'account': name, 'account_ids': sorted(account_ids.get(name, ()))}
+                          for name in outcomes if name not in failed],
+            'failed': [{'account': name, 'error': account_error(error)} for name, error in failed.items()]
+        }
+        return ORJSONResponse(content, headers=stale_headers())
         
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Cost Explorer request deadline exceeded")
     except ClientError as e:
+        if is_throttling_error(e):
+            raise HTTPException(status_code=429, detail=f"AWS Cost Explorer is throttling requests: {str(e)}")
         raise HTTPException(status_code=500, detail=f"AWS API Error: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
 
 @app.get("/costs/services")
 async def get_top_services(
+    request: Request,
     days: int = Query(30, description="Number of days to look back"),
-    limit: int = Query(10, description="Number of top services to return")
+    limit: int = Query(10, description="Number of top services to return"),
+    dimension: str = Query('SERVICE', description="Dimension to rank, e.g. SERVICE, REGION, USAGE_TYPE, LINKED_ACCOUNT or tag:<key>"),
+    parent: Optional[str] = Query(None, description="Rank within the top values of this dimension, e.g. SERVICE"),
+    parent_limit: int = Query(5, description="Number of top parent values to break down")
 ):
     """
-    Get top services by cost
+    Get top services (or any other dimension) by cost
     """
     try:
-        ce_client = get_cost_explorer_client()
+        ce_deadline.set(time.monotonic() + CE_REQUEST_DEADLINE)
+        ce_staleness.set({'stale': False})
+        media_type = columnar_media_type(request) or 'application/json'
         
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
+        group_by = [ranking_group_by(dimension)]
+        if parent is not None:
+            group_by.insert(0, ranking_group_by(parent))
         
-        response = ce_client.get_cost_and_usage(
-            TimePeriod={
-                'Start': start_date.strftime('%Y-%m-%d'),
-                'End': end_date.strftime('%Y-%m-%d')
-            },
-            Granularity='MONTHLY',
-            Metrics=['BlendedCost'],
-            GroupBy=[{'Type': 'DIMENSION', 'Key': 'SERVICE'}]
-        )
+        # The standard windows are answered from the background leaderboards
+        board = leaderboards.get(days) if parent is None and dimension == 'SERVICE' else None
+        if board is not None:
+            query = board.query
+            as_of = board.as_of.isoformat()
+        else:
+            query = services_query(days, group_by)
+            as_of = None
         
-        services = {}
-        for result in response['ResultsByTime']:
-            for group in result['Groups']:
-                service = group['Keys'][0] if group['Keys'] else 'Unknown'
-                cost = float(group['Metrics']['BlendedCost']['Amount'])
-                
-                if service in services:
-                    services[service] += cost
-                else:
-                    services[service] = cost
+        key = response_key('services', query, limit=limit, parent_limit=parent_limit, media_type=media_type, as_of=as_of)
+        not_modified = not_modified_response(request, key)
+        if not_modified:
+            return not_modified
         
-        # Sort by cost and get top services
-        top_services = sorted(services.items(), key=lambda x: x[1], reverse=True)[:limit]
+        if board is not None:
+            ranking = board.ranking(limit)
+        else:
+            totals = await cost_source.group_totals(query)
+            if parent is not None:
+                ranking = rank_nested_totals(totals, limit, parent_limit)
+            else:
+                ranking = rank_totals({group[0]: cost for group, cost in totals.items()}, limit)
         
-        return {
-            'top_services': [{'service': service, 'cost': round(cost, 2)} for service, cost in top_services],
-            'total_services': len(services),
-            'period_days': days
-        }
+        if media_type != 'application/json':
+            table = ranking_table(ranking, dimension, parent)
+            table = table.replace_schema_metadata({
+                'total_services': str(ranking['total_keys']), 'period_days': str(days),
+                'total_cost': str(ranking['total_cost']), 'other_cost': str(ranking['other']['cost']),
+                'other_count': str(ranking['other']['count']), 'as_of': as_of or ''
+            })
+            body = table_bytes(table, media_type)
+        else:
+            content = {'dimension': dimension, 'parent': parent, **ranking, 'period_days': days, 'as_of': as_of}
+            if parent is None and dimension == 'SERVICE':
+                content['top_services'] = [{'service': entry['key'], 'cost': entry['cost']} for entry in ranking['top']]
+                content['total_services'] = ranking['total_keys']
+            body = orjson.dumps(content)
+        return await cost_body_response(request, body, media_type, key, query_ttl(query))
         
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Cost Explorer request deadline exceeded")
     except ClientError as e:
+        if is_throttling_error(e):
+            raise HTTPException(status_code=429, detail=f"AWS Cost Explorer is throttling requests: {str(e)}")
         raise HTTPException(status_code=500, detail=f"AWS API Error: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
 
-@app.get("/dashboard", response_class=HTMLResponse)
-async def dashboard():
+def render_dashboard_html() -> str:
     """
     HTML dashboard with interactive charts
     """
@@ -370,7 +3137,7 @@ async def dashboard():
                 document.getElementById('totalCost').textContent = `$${data.total_cost.toFixed(2)}`;
                 document.getElementById('currency').textContent = data.currency;
                 
-                const days = data.data.length || 1;
+                const days = data.chart_data.labels.length || 1;
                 const avgCost = data.total_cost / days;
                 document.getElementById('avgCost').textContent = `$${avgCost.toFixed(2)}`;
             }
@@ -455,43 +3222,100 @@ async def dashboard():
     """
     return html_content
 
+class DashboardAsset:
+    """
+    The dashboard HTML, pre-compressed once in every supported encoding
+    """
+
+    def __init__(self, html: str):
+        body = html.encode('utf-8')
+        self.digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.bodies = {None: body, 'gzip': gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(body, quality=11)
+
+dashboard_asset = None
+
+@app.on_event("startup")
+async def precompress_dashboard():
+    global dashboard_asset
+    dashboard_asset = DashboardAsset(render_dashboard_html())
+
+@app.get("/dashboard", response_class=HTMLResponse)
+async def dashboard(request: Request):
+    """
+    HTML dashboard with interactive charts
+    """
+    asset = dashboard_asset or DashboardAsset(render_dashboard_html())
+    encoding = negotiate_encoding(request, len(asset.bodies[None]))
+    headers = {'ETag': make_etag(asset.digest, encoding), 'Vary': 'Accept-Encoding'}
+    if etag_matches(request, headers['ETag']):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return HTMLResponse(asset.bodies[encoding], headers=headers)
+
+def forecast_rows(response: Dict) -> List[Dict]:
+    return [
+        {
+            'date': result['TimePeriod']['Start'],
+            'mean_value': float(result['MeanValue']),
+            'prediction_interval_lower': float(result['PredictionIntervalLowerBound']),
+            'prediction_interval_upper': float(result['PredictionIntervalUpperBound'])
+        }
+        for result in response['ForecastResultsByTime']
+    ]
+
 @app.get("/costs/forecast")
-async def get_cost_forecast(days: int = Query(30, description="Number of days to forecast")):
+async def get_cost_forecast(
+    days: int = Query(30, description="Number of days to forecast"),
+    group_by: Optional[str] = Query(None, description="Also forecast every value of this dimension, e.g. SERVICE or LINKED_ACCOUNT")
+):
     """
-    Get cost forecast using AWS Cost Explorer
+    Get cost forecast from the configured data source
     """
     try:
-        ce_client = get_cost_explorer_client()
+        ce_deadline.set(time.monotonic() + CE_REQUEST_DEADLINE)
         
-        start_date = datetime.now()
+        start_date = datetime.now(timezone.utc)
         end_date = start_date + timedelta(days=days)
         
-        response = ce_client.get_cost_forecast(
-            TimePeriod={
+        query = {
+            'TimePeriod': {
                 'Start': start_date.strftime('%Y-%m-%d'),
                 'End': end_date.strftime('%Y-%m-%d')
             },
-            Metric='BLENDED_COST',
-            Granularity='DAILY'
-        )
-        
-        forecast_data = []
-        for result in response['ForecastResultsByTime']:
-            forecast_data.append({
-                'date': result['TimePeriod']['Start'],
-                'mean_value': float(result['MeanValue']),
-                'prediction_interval_lower': float(result['PredictionIntervalLowerBound']),
-                'prediction_interval_upper': float(result['PredictionIntervalUpperBound'])
-            })
+            'Metric': 'BLENDED_COST',
+            'Granularity': 'DAILY'
+        }
+        # Per-group forecasts are always local: one batched pass instead of a CE call per group
+        response = await (local_forecast(cost_source, query, group_by) if group_by else cost_source.forecast(query))
         
-        return {
+        forecast_data = forecast_rows(response)
+        content = {
             'forecast_data': forecast_data,
             'total_forecast': sum(item['mean_value'] for item in forecast_data),
-            'currency': 'USD',
+            'currency': response.get('Total', {}).get('Unit', 'USD'),
             'forecast_days': days
         }
+        if group_by:
+            content['groups'] = []
+            for group in response['Groups']:
+                group_data = forecast_rows(group)
+                content['groups'].append({
+                    'group': group['Keys'][0],
+                    'forecast_data': group_data,
+                    'total_forecast': sum(item['mean_value'] for item in group_data)
+                })
+        return content
         
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Cost Explorer request deadline exceeded")
     except ClientError as e:
+        if is_throttling_error(e):
+            raise HTTPException(status_code=429, detail=f"AWS Cost Explorer is throttling requests: {str(e)}")
         raise HTTPException(status_code=500, detail=f"AWS API Error: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
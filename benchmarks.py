@@ -0,0 +1,262 @@
+"""
+Benchmarks for the AWS Cost Analysis API, run against a local stub of
+Cost Explorer so no AWS credentials or network access are needed.
+
+Usage:
+    python benchmarks.py [concurrency] [processing] [serialization]
+"""
+import asyncio
+import gc
+import json
+import itertools
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+
+import httpx
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+
+import app as cost_app
+
+
+class StubCostExplorerClient:
+    """
+    Blocking stand-in for the boto3 Cost Explorer client that sleeps for a
+    fixed latency before answering, like a real CE round trip
+    """
+
+    def __init__(self, latency: float = 0.05, days: int = 30, groups: int = 0):
+        self.latency = latency
+        self.days = days
+        self.groups = groups
+        self.calls = 0
+
+    def _results_by_time(self) -> List[Dict]:
+        start = date(2024, 1, 1)
+        results = []
+        for i in range(self.days):
+            day = start + timedelta(days=i)
+            amount = {'Amount': str(10.0 + i), 'Unit': 'USD'}
+            results.append({
+                'TimePeriod': {'Start': day.isoformat(), 'End': (day + timedelta(days=1)).isoformat()},
+                'Total': {} if self.groups else {'BlendedCost': amount},
+                'Groups': [
+                    {'Keys': [f'Service {g}'], 'Metrics': {'BlendedCost': {'Amount': str(1.0 + g), 'Unit': 'USD'}}}
+                    for g in range(self.groups)
+                ],
+                'Estimated': False
+            })
+        return results
+
+    def get_cost_and_usage(self, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return {'ResultsByTime': self._results_by_time()}
+
+    def get_cost_forecast(self, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return {'ForecastResultsByTime': []}
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+_request_ids = itertools.count()
+
+
+async def _timed_request(client: httpx.AsyncClient, samples: List[float]):
+    # A distinct range per request keeps the cache and single-flight out of the
+    # measurement; every range stays within a year so the query itself stays small
+    request_id = next(_request_ids)
+    start_date = date(2024, 1, 1) + timedelta(days=request_id % 365)
+    end_date = start_date + timedelta(days=1 + (request_id // 365) % 365)
+    started = time.perf_counter()
+    response = await client.post('/costs/analyze', json={
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'granularity': 'MONTHLY'
+    })
+    response.raise_for_status()
+    samples.append(time.perf_counter() - started)
+
+
+async def _run_concurrency_level(concurrency: int, rounds: int) -> Dict[str, float]:
+    cost_app.query_cache.clear()
+    cost_app.response_etags.clear()
+    transport = httpx.ASGITransport(app=cost_app.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        samples: List[float] = []
+        for _ in range(rounds):
+            await asyncio.gather(*[_timed_request(client, samples) for _ in range(concurrency)])
+    return {'p50': percentile(samples, 50), 'p99': percentile(samples, 99)}
+
+
+def bench_concurrency(latency: float = 0.05, rounds: int = 20):
+    """
+    Fire N concurrent /costs/analyze requests at a stub with a fixed CE latency
+    and report p50/p99. With CE calls on the executor, p99 stays close to the
+    stub latency until concurrency exceeds CE_EXECUTOR_WORKERS.
+    """
+    cost_app.ce_client_manager.set_client(StubCostExplorerClient(latency=latency))
+    cost_app.ce_rate_limiter.max_rate = cost_app.ce_rate_limiter.rate = 1e6
+    cost_app.ce_rate_limiter.burst = 1e6
+    print(f'stub latency {latency * 1000:.0f} ms, executor workers {cost_app.CE_EXECUTOR_WORKERS}')
+    print(f'{"concurrency":>12} {"p50 ms":>10} {"p99 ms":>10}')
+    for concurrency in (1, 2, 4, 8, 16):
+        stats = asyncio.run(_run_concurrency_level(concurrency, rounds))
+        print(f'{concurrency:>12} {stats["p50"] * 1000:>10.1f} {stats["p99"] * 1000:>10.1f}')
+
+
+def synthetic_pages(periods: int, groups: int, page_size: int = 5000) -> List[List[Dict]]:
+    """
+    HOURLY ResultsByTime grouped by usage type, split into CE-sized pages
+    """
+    results = []
+    start = datetime(2024, 1, 1)
+    for p in range(periods):
+        hour = start + timedelta(hours=p)
+        results.append({
+            'TimePeriod': {'Start': hour.strftime('%Y-%m-%dT%H:00:00Z'),
+                           'End': (hour + timedelta(hours=1)).strftime('%Y-%m-%dT%H:00:00Z')},
+            'Total': {},
+            'Groups': [
+                {'Keys': [f'UsageType-{g}'], 'Metrics': {'BlendedCost': {'Amount': f'{(p * 7 + g) % 97 / 10:.10f}', 'Unit': 'USD'}}}
+                for g in range(groups)
+            ],
+            'Estimated': False
+        })
+    pages, cells = [], 0
+    page = []
+    for result in results:
+        page.append(result)
+        cells += groups
+        if cells >= page_size:
+            pages.append(page)
+            page, cells = [], 0
+    if page:
+        pages.append(page)
+    return pages
+
+
+def legacy_process(pages: List[List[Dict]]) -> Dict:
+    """
+    The per-row dict processing analyze_costs used before the cost matrix
+    """
+    total_cost = 0.0
+    currency = 'USD'
+    data = []
+    for results in pages:
+        for result in results:
+            for group in result['Groups']:
+                group_key = group['Keys'][0] if group['Keys'] else 'Unknown'
+                cost = float(group['Metrics']['BlendedCost']['Amount'])
+                total_cost += cost
+                currency = group['Metrics']['BlendedCost']['Unit']
+                data.append({
+                    'period_start': result['TimePeriod']['Start'],
+                    'period_end': result['TimePeriod']['End'],
+                    'group': group_key,
+                    'cost': cost,
+                    'currency': currency
+                })
+    groups = {}
+    for item in data:
+        groups.setdefault(item.get('group', 'Unknown'), []).append(item['cost'])
+    datasets = [{'label': name, 'data': costs} for name, costs in groups.items()]
+    return {'total_cost': round(total_cost, 2), 'currency': currency, 'data': data,
+            'chart_data': {'labels': [], 'datasets': datasets}}
+
+
+def matrix_process(pages: List[List[Dict]], timings: Dict[str, float] = None) -> Dict:
+    timings = timings if timings is not None else {}
+    started = time.perf_counter()
+    builder = cost_app.CostMatrixBuilder(grouped=True)
+    for results in pages:
+        builder.add_results(results)
+    collected = time.perf_counter()
+    matrix = builder.build()
+    built = time.perf_counter()
+    summary = cost_app.summarize_cost_matrix(matrix, grouped=True)
+    finished = time.perf_counter()
+    timings.update(collect=collected - started, build=built - collected, summarize=finished - built)
+    return summary
+
+
+def bench_processing(periods: int = 1000, groups: int = 500, repeat: int = 5):
+    """
+    Compare the legacy per-row path with the cost matrix path on a synthetic
+    grouped response of periods x groups cells (500k by default). The matrix
+    path is also broken down into collecting pages, building the matrix and
+    summarizing it (which still materializes one data dict per cell).
+    """
+    pages = synthetic_pages(periods, groups)
+    print(f'{periods} periods x {groups} groups = {periods * groups} cells in {len(pages)} pages')
+    best = {}
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        legacy = legacy_process(pages)
+        best['legacy'] = min(best.get('legacy', float('inf')), time.perf_counter() - started)
+        gc.collect()
+        phases = {}
+        started = time.perf_counter()
+        matrix = matrix_process(pages, phases)
+        best['matrix'] = min(best.get('matrix', float('inf')), time.perf_counter() - started)
+        for phase, elapsed in phases.items():
+            best[phase] = min(best.get(phase, float('inf')), elapsed)
+    for name in ('legacy', 'matrix', 'collect', 'build', 'summarize'):
+        indent = '  ' if name in ('collect', 'build', 'summarize') else ''
+        print(f'{indent + name:>12}: {best[name] * 1000:>8.1f} ms')
+    assert legacy['total_cost'] == matrix['total_cost']
+    assert legacy['data'] == matrix['data']
+    print(f'speedup: {best["legacy"] / best["matrix"]:.1f}x')
+
+
+def _analyze_route():
+    return next(route for route in cost_app.app.routes if getattr(route, 'path', None) == '/costs/analyze')
+
+
+def bench_serialization(sizes=((100, 100), (1000, 100), (2000, 500)), repeat: int = 3):
+    """
+    Time turning an analyze_costs summary into response bytes: the old
+    response_model path (CostResponse validation, FastAPI serialization,
+    stdlib json) against the ORJSONResponse path used now, for 10k, 100k and
+    1M data rows
+    """
+    route = _analyze_route()
+    print(f'{"rows":>10} {"response_model ms":>18} {"orjson ms":>10} {"speedup":>8}')
+    for periods, groups in sizes:
+        summary = matrix_process(synthetic_pages(periods, groups))
+        best = {}
+        for _ in range(repeat):
+            gc.collect()
+            started = time.perf_counter()
+            content = asyncio.run(serialize_response(field=route.response_field,
+                                                     response_content=cost_app.CostResponse(**summary)))
+            legacy_body = JSONResponse(content).body
+            best['legacy'] = min(best.get('legacy', float('inf')), time.perf_counter() - started)
+            gc.collect()
+            started = time.perf_counter()
+            body = ORJSONResponse(summary).body
+            best['orjson'] = min(best.get('orjson', float('inf')), time.perf_counter() - started)
+        assert json.loads(legacy_body) == json.loads(body)
+        print(f'{periods * groups:>10} {best["legacy"] * 1000:>18.1f} {best["orjson"] * 1000:>10.1f} '
+              f'{best["legacy"] / best["orjson"]:>7.1f}x')
+
+
+BENCHMARKS = {
+    'concurrency': bench_concurrency,
+    'processing': bench_processing,
+    'serialization': bench_serialization,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
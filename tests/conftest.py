@@ -0,0 +1,32 @@
+"""
+Shared setup for the API tests: app settings are read from the environment
+at import time, so they are pinned here before app is first imported
+"""
+import os
+import sys
+
+os.environ.setdefault('CE_CACHE_BACKEND', 'memory')
+os.environ.setdefault('CACHE_WARMUP', 'false')
+os.environ.setdefault('LEADERBOARD_WINDOWS', '')
+os.environ.setdefault('COST_DATA_SOURCE', 'cost_explorer')
+os.environ.setdefault('CE_ACCOUNTS', '')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import app as cost_app
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(tmp_path, monkeypatch):
+    """
+    Empty caches, a per-test cost store and a rate limiter that never makes
+    tests wait, with the default client restored afterwards
+    """
+    cost_app.query_cache.clear()
+    cost_app.response_etags.clear()
+    monkeypatch.setattr(cost_app, 'cost_store', cost_app.CostStore(str(tmp_path / 'cost_store.db')))
+    monkeypatch.setattr(cost_app, 'ce_rate_limiter', cost_app.AdaptiveRateLimiter(max_rate=1000, burst=1000))
+    monkeypatch.setattr(cost_app, 'ce_accounts', {})
+    yield
+    cost_app.ce_client_manager.reset()
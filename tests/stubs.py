@@ -0,0 +1,175 @@
+"""
+Stub Cost Explorer client, CUR report writer and request helper for the API tests
+"""
+import asyncio
+import csv
+import gzip
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+
+import httpx
+from botocore.exceptions import ClientError
+
+import app as cost_app
+
+
+class StubCostExplorerClient:
+    """
+    Blocking stand-in for the boto3 Cost Explorer client. A group's cost on a
+    day is the day of the month plus the group's index, so MONTHLY amounts
+    are exactly the sums of the DAILY ones. Days in empty_days have no cost.
+    page_size counts periods, or groups when split_groups is set, in which
+    case a period's groups can continue on the next page as in Cost Explorer.
+    """
+
+    def __init__(self, account_id: str = '111111111111', groups=('Amazon EC2', 'Amazon S3'), empty_days=(),
+                 page_size: int = 0, split_groups: bool = False, latency: float = 0.0, error: str = None,
+                 throttles: int = 0):
+        self.account_id = account_id
+        self.groups = list(groups)
+        self.empty_days = set(empty_days)
+        self.page_size = page_size
+        self.split_groups = split_groups
+        self.latency = latency
+        self.error = error
+        self.throttles = throttles
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def daily_cells(self, day: date, group_by: List[Dict]) -> List[Dict]:
+        if day.isoformat() in self.empty_days:
+            return []
+        cells = []
+        for index, name in enumerate(self.groups):
+            keys = [self.account_id if group['Key'] == 'LINKED_ACCOUNT' else name for group in group_by]
+            cells.append((keys, float(day.day + index)))
+        return cells
+
+    def results(self, query: Dict) -> List[Dict]:
+        start = date.fromisoformat(query['TimePeriod']['Start'])
+        end = date.fromisoformat(query['TimePeriod']['End'])
+        group_by = query.get('GroupBy', [])
+        periods = []
+        day = start
+        while day < end:
+            if query['Granularity'] == 'MONTHLY':
+                next_month = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+                periods.append((day, min(next_month, end)))
+                day = min(next_month, end)
+            else:
+                periods.append((day, day + timedelta(days=1)))
+                day += timedelta(days=1)
+        results = []
+        for period_start, period_end in periods:
+            totals = {}
+            day = period_start
+            while day < period_end:
+                for keys, amount in self.daily_cells(day, group_by):
+                    totals[tuple(keys)] = totals.get(tuple(keys), 0.0) + amount
+                day += timedelta(days=1)
+            metrics = lambda amount: {metric: {'Amount': str(amount), 'Unit': 'USD'} for metric in query['Metrics']}
+            result = {'TimePeriod': {'Start': period_start.isoformat(), 'End': period_end.isoformat()},
+                      'Total': {}, 'Groups': [], 'Estimated': False}
+            if group_by:
+                result['Groups'] = [{'Keys': list(keys), 'Metrics': metrics(amount)} for keys, amount in totals.items()]
+            else:
+                result['Total'] = metrics(sum(totals.values()))
+            results.append(result)
+        return results
+
+    def get_cost_and_usage(self, **query):
+        with self._lock:
+            self.calls.append(query)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            throttled = self.throttles > 0
+            self.throttles -= throttled
+        try:
+            time.sleep(self.latency)
+            if throttled:
+                raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'GetCostAndUsage')
+            if self.error:
+                raise ClientError({'Error': {'Code': self.error, 'Message': 'stub error'}}, 'GetCostAndUsage')
+            results = self.results(query)
+            if self.split_groups and self.page_size:
+                results = [dict(result, Groups=[group]) for result in results for group in result['Groups']]
+            if not self.page_size:
+                return {'ResultsByTime': results}
+            offset = int(query.get('NextPageToken') or 0)
+            page = results[offset:offset + self.page_size]
+            if self.split_groups:
+                # Consecutive cells of one period go back into a single result
+                merged = []
+                for result in page:
+                    if merged and merged[-1]['TimePeriod'] == result['TimePeriod']:
+                        merged[-1]['Groups'] += result['Groups']
+                    else:
+                        merged.append(dict(result, Groups=list(result['Groups'])))
+                page = merged
+            response = {'ResultsByTime': page}
+            if offset + self.page_size < len(results):
+                response['NextPageToken'] = str(offset + self.page_size)
+            return response
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def request(method: str, path: str, **kwargs) -> httpx.Response:
+    """
+    Send one request to the app in-process, without running its startup hooks
+    """
+    async def send():
+        transport = httpx.ASGITransport(app=cost_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await client.request(method, path, **kwargs)
+    return asyncio.run(send())
+
+
+CUR_HEADER = ['identity/LineItemId', 'lineItem/UsageStartDate', 'lineItem/UsageAccountId', 'lineItem/ProductCode',
+              'lineItem/UsageType', 'lineItem/UsageAmount', 'lineItem/CurrencyCode', 'lineItem/UnblendedCost',
+              'lineItem/BlendedCost', 'product/ProductName', 'product/region']
+CUR_SERVICES = [('Amazon Elastic Compute Cloud', 'AmazonEC2'), ('Amazon Simple Storage Service', 'AmazonS3'), ('', 'Tax')]
+
+
+def cur_rows(start: datetime, hours: int, seed: int = 0, services=CUR_SERVICES) -> List[Dict]:
+    """
+    Random CUR line items, some of them repeating the same hour and
+    dimensions. Tax lines have no product name, as in real reports.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for hour in range(hours):
+        moment = start + timedelta(hours=hour)
+        for name, code in services:
+            for region, account in (('us-east-1', '111122223333'), ('eu-west-1', '444455556666')):
+                for _ in range(rng.randint(0, 2)):
+                    rows.append({'start': moment, 'service': name or code, 'product_name': name, 'product_code': code,
+                                 'region': region, 'usage_type': f'{region}-{code}-Usage', 'account': account,
+                                 'blended': round(rng.random(), 6), 'unblended': round(rng.random(), 6),
+                                 'usage': float(rng.randint(1, 5))})
+    return rows
+
+
+def write_cur_report(path: str, rows: List[Dict]):
+    """
+    Write rows from cur_rows as a CSV, gzipped CSV or Parquet CUR report file
+    """
+    records = [[f'id-{i}', row['start'].strftime('%Y-%m-%dT%H:00:00Z'), row['account'], row['product_code'],
+                row['usage_type'], row['usage'], 'USD', row['unblended'], row['blended'], row['product_name'],
+                row['region']] for i, row in enumerate(rows)]
+    if path.endswith('.parquet'):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        pq.write_table(pa.table({name: [record[i] for record in records] for i, name in enumerate(CUR_HEADER)}), path)
+        return
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt', newline='') as report:
+        writer = csv.writer(report)
+        writer.writerow(CUR_HEADER)
+        writer.writerows(records)
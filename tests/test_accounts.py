@@ -0,0 +1,113 @@
+"""
+Multi-account fan-out through /costs/accounts, with stub clients set per account
+"""
+import pytest
+from botocore.credentials import DeferredRefreshableCredentials
+
+import app as cost_app
+from stubs import StubCostExplorerClient, request
+
+BODY = {'start_date': '2024-01-01', 'end_date': '2024-01-04', 'granularity': 'DAILY'}
+
+
+@pytest.fixture
+def accounts(monkeypatch):
+    configured = cost_app.parse_accounts('prod=arn:aws:iam::111111111111:role/CostReader,staging=staging,dev')
+    monkeypatch.setattr(cost_app, 'ce_accounts', configured)
+    stubs = {
+        'prod': StubCostExplorerClient(account_id='111111111111'),
+        'staging': StubCostExplorerClient(account_id='222222222222', groups=('Amazon S3',)),
+        'dev': StubCostExplorerClient(account_id='333333333333', error='AccessDeniedException')
+    }
+    for name, stub in stubs.items():
+        configured[name].client_manager.set_client(stub)
+    return stubs
+
+
+def test_parse_accounts():
+    accounts = cost_app.parse_accounts(' prod=arn:aws:iam::111111111111:role/CostReader, staging=ops ,dev,,')
+    assert list(accounts) == ['prod', 'staging', 'dev']
+    assert accounts['prod'].client_manager.role_arn == 'arn:aws:iam::111111111111:role/CostReader'
+    assert accounts['prod'].client_manager.profile_name is None
+    assert accounts['staging'].client_manager.profile_name == 'ops'
+    assert accounts['dev'].client_manager.profile_name == 'dev'
+    assert accounts['prod'].rate_limiter is not accounts['staging'].rate_limiter
+
+
+def test_assumed_role_credentials_are_deferred(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'source-key')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'source-secret')
+    manager = cost_app.CostExplorerClientManager(role_arn='arn:aws:iam::111111111111:role/CostReader')
+    credentials = manager._create_session().get_credentials()
+    # Nothing is fetched from STS until the first signed request
+    assert isinstance(credentials, DeferredRefreshableCredentials)
+    assert credentials.method == 'assume-role'
+
+
+def test_merges_accounts_and_reports_partial_failure(accounts):
+    response = request('POST', '/costs/accounts', json=BODY)
+    assert response.status_code == 200
+    content = response.json()
+    assert content['accounts']['succeeded'] == [
+        {'account': 'prod', 'account_ids': ['111111111111']},
+        {'account': 'staging', 'account_ids': ['222222222222']}
+    ]
+    assert [failure['account'] for failure in content['accounts']['failed']] == ['dev']
+    assert 'AccessDeniedException' in content['accounts']['failed'][0]['error']
+    # Each account's query is grouped by LINKED_ACCOUNT, so rows carry both name and ID
+    assert {(row['account'], row['account_id']) for row in content['data']} == {
+        ('prod', '111111111111'), ('staging', '222222222222')
+    }
+    # Jan 1-3: prod has two groups (day and day + 1), staging one (day)
+    assert content['total_cost'] == (1 + 2 + 2 + 3 + 3 + 4) + (1 + 2 + 3)
+    assert all(call['GroupBy'][0]['Key'] == 'LINKED_ACCOUNT' for call in accounts['prod'].calls)
+
+
+def test_group_by_within_accounts(accounts):
+    response = request('POST', '/costs/accounts', json=dict(BODY, group_by='SERVICE', accounts=['prod']))
+    assert response.status_code == 200
+    groups = {row['group'] for row in response.json()['data']}
+    assert groups == {'prod (111111111111) / Amazon EC2', 'prod (111111111111) / Amazon S3'}
+    assert accounts['staging'].calls == []
+
+
+def test_accounts_are_cached_separately(accounts):
+    request('POST', '/costs/accounts', json=dict(BODY, accounts=['prod', 'staging']))
+    calls = len(accounts['prod'].calls), len(accounts['staging'].calls)
+    request('POST', '/costs/accounts', json=dict(BODY, accounts=['prod', 'staging']))
+    assert (len(accounts['prod'].calls), len(accounts['staging'].calls)) == calls
+    assert accounts['prod'].calls and accounts['staging'].calls
+
+
+def test_fan_out_is_bounded(monkeypatch):
+    monkeypatch.setattr(cost_app, 'CE_ACCOUNT_CONCURRENCY', 2)
+    configured = cost_app.parse_accounts('a,b,c,d,e')
+    monkeypatch.setattr(cost_app, 'ce_accounts', configured)
+    stub = StubCostExplorerClient(latency=0.05)
+    for account in configured.values():
+        account.client_manager.set_client(stub)
+    response = request('POST', '/costs/accounts', json=BODY)
+    assert response.status_code == 200
+    assert len(response.json()['accounts']['succeeded']) == 5
+    assert stub.max_active == 2
+
+
+def test_throttles_only_slow_the_throttled_account(accounts):
+    accounts['prod'].throttles = 1
+    response = request('POST', '/costs/accounts', json=dict(BODY, accounts=['prod', 'staging']))
+    assert response.status_code == 200
+    assert cost_app.ce_accounts['prod'].rate_limiter.throttles == 1
+    assert cost_app.ce_accounts['staging'].rate_limiter.throttles == 0
+    assert cost_app.ce_rate_limiter.throttles == 0
+
+
+def test_every_account_failing_fails_the_request(accounts):
+    response = request('POST', '/costs/accounts', json=dict(BODY, accounts=['dev']))
+    assert response.status_code == 500
+    assert 'AccessDeniedException' in response.json()['detail']
+
+
+def test_unknown_and_unconfigured_accounts(accounts, monkeypatch):
+    assert request('POST', '/costs/accounts', json=dict(BODY, accounts=['nope'])).status_code == 400
+    monkeypatch.setattr(cost_app, 'ce_accounts', {})
+    assert request('POST', '/costs/accounts', json=BODY).status_code == 400
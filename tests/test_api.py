@@ -0,0 +1,41 @@
+"""
+End-to-end tests of the cost endpoints against a stub Cost Explorer client
+installed with ce_client_manager.set_client, using the in-memory cache
+"""
+
+import app as cost_app
+from stubs import StubCostExplorerClient, request
+
+JANUARY = {'start_date': '2024-01-01', 'end_date': '2024-02-01', 'granularity': 'DAILY'}
+
+
+def install(stub: StubCostExplorerClient) -> StubCostExplorerClient:
+    cost_app.ce_client_manager.set_client(stub)
+    return stub
+
+
+def test_uses_memory_cache_backend():
+    assert isinstance(cost_app.query_cache.backend, cost_app.MemoryCacheBackend)
+
+
+def test_analyze_ungrouped():
+    stub = install(StubCostExplorerClient())
+    response = request('POST', '/costs/analyze', json=dict(JANUARY, end_date='2024-01-04'))
+    assert response.status_code == 200
+    content = response.json()
+    assert [row['cost'] for row in content['data']] == [3.0, 5.0, 7.0]
+    assert content['total_cost'] == 15.0
+    assert content['chart_data']['labels'] == ['2024-01-01', '2024-01-02', '2024-01-03']
+    assert len(stub.calls) == 1
+
+
+def test_set_client_replaces_the_shared_client(monkeypatch):
+    monkeypatch.setattr(cost_app, 'cost_store', None)
+    first = install(StubCostExplorerClient())
+    request('POST', '/costs/analyze', json=dict(JANUARY, end_date='2024-01-02'))
+    cost_app.query_cache.clear()
+    second = install(StubCostExplorerClient())
+    request('POST', '/costs/analyze', json=dict(JANUARY, end_date='2024-01-02'))
+    assert len(first.calls) == 1 and len(second.calls) == 1
+    cost_app.ce_client_manager.reset()
+    assert cost_app.ce_client_manager._client is None
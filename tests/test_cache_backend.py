@@ -0,0 +1,80 @@
+"""
+SqliteCacheBackend shared between worker processes: one process fetches a
+query under its lease while the other waits for the fill, and the entry is
+then a hit for every process using the same database
+"""
+import asyncio
+import multiprocessing
+import time
+
+import app as cost_app
+
+
+class SlowClient:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    def get_cost_and_usage(self, **query):
+        self.calls += 1
+        time.sleep(self.latency)
+        return {'ResultsByTime': [{'TimePeriod': query['TimePeriod'], 'Total': {}, 'Groups': [], 'Estimated': False}]}
+
+
+QUERY = {
+    'TimePeriod': {'Start': '2024-01-01', 'End': '2024-01-02'},
+    'Granularity': 'DAILY',
+    'Metrics': ['BlendedCost']
+}
+
+
+def fetch_in_worker(path, barrier, results):
+    cost_app.query_cache = cost_app.QueryCache(backend=cost_app.SqliteCacheBackend(path))
+    client = SlowClient(latency=0.5)
+    cost_app.ce_client_manager.set_client(client)
+    barrier.wait()
+    response = asyncio.run(cost_app.cached_ce_call('get_cost_and_usage', **QUERY))
+    results.put((client.calls, cost_app.query_cache.hits, response))
+
+
+def hold_lease(path, ttl):
+    backend = cost_app.SqliteCacheBackend(path)
+    assert backend.acquire_lease('key', ttl)
+
+
+def test_lease_hand_off_and_shared_hit(tmp_path):
+    path = str(tmp_path / 'ce_cache.db')
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(2)
+    results = ctx.Queue()
+    workers = [ctx.Process(target=fetch_in_worker, args=(path, barrier, results)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    outcomes = [results.get(timeout=60) for _ in workers]
+    for worker in workers:
+        worker.join(timeout=60)
+        assert worker.exitcode == 0
+
+    # One process called Cost Explorer, the other was handed the filled entry
+    assert sorted(calls for calls, _, _ in outcomes) == [0, 1]
+    assert [hits for calls, hits, _ in outcomes if calls == 0] == [1]
+    assert outcomes[0][2] == outcomes[1][2]
+
+    # A third process sees the entry as a plain hit
+    cache = cost_app.QueryCache(backend=cost_app.SqliteCacheBackend(path))
+    assert cache.get(cost_app.normalize_query('get_cost_and_usage', QUERY)) == outcomes[0][2]
+
+
+def test_lease_expires_when_holder_dies(tmp_path):
+    path = str(tmp_path / 'ce_cache.db')
+    holder = multiprocessing.get_context('spawn').Process(target=hold_lease, args=(path, 2.0))
+    holder.start()
+    holder.join(timeout=60)
+    assert holder.exitcode == 0
+
+    backend = cost_app.SqliteCacheBackend(path)
+    assert backend.lease_held('key')
+    assert not backend.acquire_lease('key', 1.0)
+    time.sleep(2.1)
+    assert not backend.lease_held('key')
+    assert backend.acquire_lease('key', 1.0)
@@ -0,0 +1,55 @@
+"""
+Tests of the Arrow IPC and Parquet response formats
+"""
+import io
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+import app as cost_app
+from stubs import StubCostExplorerClient, request
+
+BODY = {'start_date': '2024-01-01', 'end_date': '2024-02-01', 'granularity': 'DAILY', 'group_by': 'SERVICE'}
+
+
+def read_table(response):
+    if response.headers['content-type'].startswith(cost_app.ARROW_STREAM_MEDIA_TYPE):
+        return pa.ipc.open_stream(response.content).read_all()
+    return pq.read_table(io.BytesIO(response.content))
+
+
+@pytest.mark.parametrize('media_type', (cost_app.ARROW_STREAM_MEDIA_TYPE,) + cost_app.PARQUET_MEDIA_TYPES)
+def test_analyze_rows_match_the_json_response(media_type):
+    cost_app.ce_client_manager.set_client(StubCostExplorerClient(page_size=7))
+    content = request('POST', '/costs/analyze', json=BODY).json()
+    response = request('POST', '/costs/analyze', json=BODY, headers={'Accept': media_type})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith(media_type)
+    table = read_table(response)
+    assert table.column_names == ['period_start', 'period_end', 'group', 'cost', 'currency']
+    assert pa.types.is_dictionary(table.schema.field('group').type)
+    rows = sorted(zip(table.column('period_start').to_pylist(), table.column('group').to_pylist(),
+                      table.column('cost').to_pylist()))
+    assert rows == sorted((row['period_start'], row['group'], row['cost']) for row in content['data'])
+    assert float(table.schema.metadata[b'total_cost']) == content['total_cost']
+
+
+def test_services_ranking_as_arrow():
+    cost_app.ce_client_manager.set_client(StubCostExplorerClient(groups=('Amazon EC2', 'Amazon S3', 'AWS Lambda')))
+    response = request('GET', '/costs/services', params={'days': 10, 'limit': 2},
+                       headers={'Accept': cost_app.ARROW_STREAM_MEDIA_TYPE})
+    table = read_table(response)
+    assert table.column('service').to_pylist() == ['AWS Lambda', 'Amazon S3']
+    assert table.schema.metadata[b'total_services'] == b'3'
+    assert table.schema.metadata[b'other_count'] == b'1'
+
+
+def test_formats_get_their_own_etags():
+    cost_app.ce_client_manager.set_client(StubCostExplorerClient())
+    json_etag = request('POST', '/costs/analyze', json=BODY).headers['etag']
+    arrow = request('POST', '/costs/analyze', json=BODY,
+                    headers={'Accept': cost_app.ARROW_STREAM_MEDIA_TYPE, 'If-None-Match': json_etag})
+    assert arrow.status_code == 200
+    assert arrow.headers['etag'] != json_etag
@@ -0,0 +1,58 @@
+"""
+The SQLite cost store of closed billing days, and the settle cutoff it
+shares with the response cache
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import app as cost_app
+from stubs import StubCostExplorerClient, request
+
+JANUARY = {'start_date': '2024-01-01', 'end_date': '2024-02-01', 'granularity': 'DAILY', 'group_by': 'SERVICE'}
+
+
+def test_store_round_trip_keeps_days_without_groups():
+    empty = {'2024-01-06', '2024-01-07', '2024-01-20'}
+    stub = StubCostExplorerClient(empty_days=empty)
+    cost_app.ce_client_manager.set_client(stub)
+    from_ce = request('POST', '/costs/analyze', json=JANUARY).json()
+    calls = len(stub.calls)
+
+    cost_app.query_cache.clear()
+    cost_app.response_etags.clear()
+    from_store = request('POST', '/costs/analyze', json=JANUARY).json()
+    assert len(stub.calls) == calls
+    assert len(from_store['chart_data']['labels']) == 31
+    assert from_store == from_ce
+
+
+def test_stored_metrics_are_merged():
+    store = cost_app.cost_store
+    store.mark_stored('SERVICE', ['UnblendedCost'], ['2024-01-01'])
+    store.mark_stored('SERVICE', ['BlendedCost'], ['2024-01-01', '2024-01-02'])
+    assert store.stored_days('SERVICE', ['UnblendedCost'], '2024-01-01', '2024-01-03') == {'2024-01-01'}
+    assert store.stored_days('SERVICE', ['BlendedCost'], '2024-01-01', '2024-01-03') == {'2024-01-01', '2024-01-02'}
+    assert store.stored_days('SERVICE', ['BlendedCost', 'UnblendedCost'], '2024-01-01', '2024-01-03') == {'2024-01-01'}
+
+
+def test_store_is_opened_by_the_startup_hook(tmp_path, monkeypatch):
+    path = tmp_path / 'store.db'
+    monkeypatch.setattr(cost_app, 'COST_STORE_PATH', str(path))
+    monkeypatch.setattr(cost_app, 'cost_store', None)
+    assert not path.exists()
+    asyncio.run(cost_app.open_cost_store())
+    assert isinstance(cost_app.cost_store, cost_app.CostStore)
+    assert path.exists()
+
+
+def test_cache_and_store_share_the_settle_cutoff():
+    cutoff = cost_app.closed_before()
+    settled = datetime.now(timezone.utc) - timedelta(days=cost_app.COST_STORE_SETTLE_DAYS)
+    assert cutoff == settled.strftime('%Y-%m-01')
+
+    def ttl(end: str) -> int:
+        return cost_app.query_ttl({'TimePeriod': {'Start': '2020-01-01', 'End': end}, 'Granularity': 'DAILY'})
+
+    day_after = (datetime.strptime(cutoff, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    assert ttl(cutoff) == cost_app.CE_CACHE_CLOSED_TTL
+    assert ttl(day_after) == cost_app.CE_CACHE_TTLS['DAILY']
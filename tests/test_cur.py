@@ -0,0 +1,116 @@
+"""
+Tests of the local CUR data source against sums over the raw line items
+"""
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import app as cost_app
+from stubs import cur_rows, request, write_cur_report
+
+JANUARY = {'TimePeriod': {'Start': '2024-01-01', 'End': '2024-02-01'}, 'Metrics': ['BlendedCost', 'UsageQuantity']}
+DIMENSION_FIELDS = {'SERVICE': 'service', 'REGION': 'region', 'USAGE_TYPE': 'usage_type', 'LINKED_ACCOUNT': 'account'}
+
+
+def raw_sums(rows, period, dimensions=(), field='blended'):
+    sums = {}
+    for row in rows:
+        key = (period(row['start']),) + tuple(row[DIMENSION_FIELDS[dimension]] for dimension in dimensions)
+        sums[key] = sums.get(key, 0.0) + row[field]
+    return sums
+
+
+def result_sums(results, metric='BlendedCost'):
+    sums = {}
+    for result in results:
+        cells = result['Groups'] or [{'Keys': [], 'Metrics': result['Total']}]
+        for cell in cells:
+            sums[(result['TimePeriod']['Start'],) + tuple(cell['Keys'])] = float(cell['Metrics'][metric]['Amount'])
+    return sums
+
+
+@pytest.fixture
+def source(tmp_path):
+    rows = cur_rows(datetime(2024, 1, 1), 24 * 31, seed=1)
+    write_cur_report(str(tmp_path / 'report-1.csv.gz'), rows[:len(rows) // 2])
+    write_cur_report(str(tmp_path / 'report-2.csv'), rows[len(rows) // 2:])
+    source = cost_app.CurSource(str(tmp_path))
+    source.ingest()
+    return source, rows
+
+
+def test_dictionary_codes_are_stable():
+    dictionary = cost_app.CurDictionary()
+    first = dictionary.encode(np.array(['b', 'a', 'b'], dtype=object))
+    second = dictionary.encode(np.array(['c', 'a'], dtype=object))
+    assert [dictionary.labels[code] for code in first.tolist() + second.tolist()] == ['b', 'a', 'b', 'c', 'a']
+    assert dictionary.codes == {label: code for code, label in enumerate(dictionary.labels)}
+
+    copy = dictionary.copy()
+    copy.encode(np.array(['d'], dtype=object))
+    assert 'd' not in dictionary.codes
+
+    compacted, mapping = dictionary.compact(np.array([False, True, True]))
+    assert compacted.labels == dictionary.labels[1:]
+    assert mapping.tolist() == [-1, 0, 1]
+
+
+def test_partition_compacts_rows_by_hour_and_dimensions(tmp_path):
+    rows = cur_rows(datetime(2024, 1, 1), 48, seed=2)
+    path = str(tmp_path / 'report.csv')
+    write_cur_report(path, rows + rows)
+    dictionaries = {dimension: cost_app.CurDictionary() for dimension in cost_app.CUR_DIMENSION_COLUMNS}
+    partition = cost_app.CurPartition.from_files([path], dictionaries)
+
+    keys = {(row['start'], row['service'], row['region'], row['usage_type'], row['account']) for row in rows}
+    assert len(partition.hours) == len(keys)
+    assert np.all(np.diff(partition.hours) >= 0)
+    assert partition.metrics['BlendedCost'].sum() == pytest.approx(2 * sum(row['blended'] for row in rows))
+    # Tax lines have no product name and are labelled with their product code
+    assert 'Tax' in dictionaries['SERVICE'].labels
+
+
+@pytest.mark.parametrize('granularity, period', [
+    ('DAILY', lambda moment: moment.date().isoformat()),
+    ('MONTHLY', lambda moment: moment.strftime('%Y-%m-01')),
+])
+@pytest.mark.parametrize('dimensions', [(), ('SERVICE',), ('REGION', 'LINKED_ACCOUNT')])
+def test_results_match_raw_rows(source, granularity, period, dimensions):
+    source, rows = source
+    query = dict(JANUARY, Granularity=granularity, GroupBy=[{'Type': 'DIMENSION', 'Key': key} for key in dimensions])
+    results = source.cube.results_by_time(query)
+    expected = raw_sums(rows, period, dimensions)
+    assert result_sums(results) == pytest.approx(expected)
+    assert result_sums(results, 'UsageQuantity') == pytest.approx(raw_sums(rows, period, dimensions, 'usage'))
+
+
+def test_filter_and_group_totals_match_raw_rows(source):
+    source, rows = source
+    query = dict(JANUARY, Granularity='DAILY', GroupBy=[{'Type': 'DIMENSION', 'Key': 'SERVICE'}],
+                 Filter={'Dimensions': {'Key': 'REGION', 'Values': ['eu-west-1']}})
+    eu_rows = [row for row in rows if row['region'] == 'eu-west-1']
+    assert result_sums(source.cube.results_by_time(query)) == pytest.approx(
+        raw_sums(eu_rows, lambda moment: moment.date().isoformat(), ('SERVICE',)))
+    totals = source.cube.group_totals(dict(query, Filter=None))
+    assert totals == pytest.approx({key[1:]: cost for key, cost in raw_sums(rows, lambda _: None, ('SERVICE',)).items()})
+
+
+def test_parquet_reports_are_read(tmp_path):
+    pytest.importorskip('pyarrow')
+    rows = cur_rows(datetime(2024, 1, 1), 24, seed=3)
+    write_cur_report(str(tmp_path / 'report.parquet'), rows)
+    source = cost_app.CurSource(str(tmp_path))
+    source.ingest()
+    totals = source.cube.group_totals(dict(JANUARY, Granularity='MONTHLY', GroupBy=[{'Type': 'DIMENSION', 'Key': 'SERVICE'}]))
+    assert totals == pytest.approx({key[1:]: cost for key, cost in raw_sums(rows, lambda _: None, ('SERVICE',)).items()})
+
+
+def test_analyze_is_served_from_cur(source, monkeypatch):
+    source, rows = source
+    monkeypatch.setattr(cost_app, 'cost_source', source)
+    content = request('POST', '/costs/analyze', json={
+        'start_date': '2024-01-01', 'end_date': '2024-02-01', 'granularity': 'MONTHLY', 'group_by': 'SERVICE'
+    }).json()
+    assert content['total_cost'] == pytest.approx(sum(row['blended'] for row in rows), abs=0.05)
+    assert sorted(row['group'] for row in content['data']) == sorted({row['service'] for row in rows})
@@ -0,0 +1,117 @@
+"""
+Tests of incremental CUR re-ingestion driven by manifests and file checksums
+"""
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+import app as cost_app
+from stubs import CUR_SERVICES, cur_rows, write_cur_report
+
+QUERY = {'TimePeriod': {'Start': '2024-01-01', 'End': '2024-03-01'}, 'Granularity': 'MONTHLY',
+         'Metrics': ['BlendedCost'], 'GroupBy': [{'Type': 'DIMENSION', 'Key': 'SERVICE'}]}
+
+
+def write_period(directory, month: int, rows, files: int = 2):
+    """
+    Write a billing period the way CUR delivers it: report files under the
+    period's prefix and a manifest listing their S3 keys
+    """
+    prefix = f'2024{month:02d}01-2024{month + 1:02d}01'
+    os.makedirs(directory / 'costs' / prefix, exist_ok=True)
+    keys = []
+    for part in range(files):
+        key = f'reports/costs/{prefix}/costs-{part + 1}.csv.gz'
+        path = str(directory / 'costs' / prefix / f'costs-{part + 1}.csv.gz')
+        write_cur_report(path, rows[part::files])
+        # Rewrites within one test must not look unchanged to the mtime check
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000 * month))
+        keys.append(key)
+    with open(directory / 'costs' / prefix / 'costs-Manifest.json', 'w') as manifest:
+        json.dump({'reportName': 'costs', 'billingPeriod': {'start': f'2024{month:02d}01T000000.000Z'},
+                   'reportKeys': keys}, manifest)
+
+
+def service_totals(source):
+    return source.cube.group_totals(QUERY)
+
+
+def raw_service_totals(*row_sets):
+    totals = {}
+    for rows in row_sets:
+        for row in rows:
+            totals[(row['service'],)] = totals.get((row['service'],), 0.0) + row['blended']
+    return totals
+
+
+def test_unchanged_periods_are_not_reparsed(tmp_path):
+    january, february = cur_rows(datetime(2024, 1, 1), 48, seed=1), cur_rows(datetime(2024, 2, 1), 48, seed=2)
+    write_period(tmp_path, 1, january)
+    write_period(tmp_path, 2, february)
+    source = cost_app.CurSource(str(tmp_path))
+    assert source.ingest()
+    assert source.last_refresh['rebuilt'] == ['costs/20240101', 'costs/20240201']
+    assert service_totals(source) == pytest.approx(raw_service_totals(january, february))
+
+    cube = source.cube
+    assert not source.ingest()
+    assert source.last_refresh['rebuilt'] == []
+    assert source.cube is cube
+
+
+def test_changed_manifest_rebuilds_only_its_period(tmp_path):
+    january, february = cur_rows(datetime(2024, 1, 1), 48, seed=1), cur_rows(datetime(2024, 2, 1), 48, seed=2)
+    write_period(tmp_path, 1, january)
+    write_period(tmp_path, 2, february)
+    source = cost_app.CurSource(str(tmp_path))
+    source.ingest()
+    old_cube = source.cube
+    old_totals = service_totals(source)
+
+    # AWS restates February with a new service and a different file split
+    restated = cur_rows(datetime(2024, 2, 1), 48, seed=3,
+                        services=CUR_SERVICES + [('Amazon CloudFront', 'AmazonCloudFront')])
+    write_period(tmp_path, 2, restated, files=3)
+    assert source.ingest()
+    assert source.last_refresh['rebuilt'] == ['costs/20240201']
+    assert source.cube.partitions['costs/20240101'] is old_cube.partitions['costs/20240101']
+    assert service_totals(source) == pytest.approx(raw_service_totals(january, restated))
+    # Queries holding the previous snapshot keep their answers
+    assert old_cube.group_totals(QUERY) == pytest.approx(old_totals)
+
+
+def test_period_waits_for_all_of_its_files(tmp_path):
+    january = cur_rows(datetime(2024, 1, 1), 48, seed=1)
+    write_period(tmp_path, 1, january)
+    source = cost_app.CurSource(str(tmp_path))
+    source.ingest()
+
+    february = cur_rows(datetime(2024, 2, 1), 48, seed=2)
+    write_period(tmp_path, 2, february)
+    os.remove(tmp_path / 'costs' / '20240201-20240301' / 'costs-2.csv.gz')
+    assert not source.ingest()
+    assert list(source.cube.partitions) == ['costs/20240101']
+
+
+def test_removed_period_is_dropped_and_dictionaries_compacted(tmp_path, monkeypatch):
+    monkeypatch.setattr(cost_app, 'CUR_DICTIONARY_MIN_SIZE', 1)
+    january = cur_rows(datetime(2024, 1, 1), 48, seed=1)
+    # Enough labels only February uses that dropping them halves the dictionary
+    retired = [(f'Retired Service {i}', f'Retired{i}') for i in range(8)]
+    february = cur_rows(datetime(2024, 2, 1), 48, seed=2, services=retired)
+    write_period(tmp_path, 1, january)
+    write_period(tmp_path, 2, february)
+    source = cost_app.CurSource(str(tmp_path))
+    source.ingest()
+    assert 'Retired Service 0' in source.dictionaries['SERVICE'].labels
+
+    for name in os.listdir(tmp_path / 'costs' / '20240201-20240301'):
+        os.remove(tmp_path / 'costs' / '20240201-20240301' / name)
+    assert source.ingest()
+    assert source.last_refresh['removed'] == ['costs/20240201']
+    assert source.dictionaries['SERVICE'].labels == ['Amazon Elastic Compute Cloud', 'Amazon Simple Storage Service', 'Tax']
+    assert service_totals(source) == pytest.approx(raw_service_totals(january))
+
@@ -0,0 +1,77 @@
+"""
+Tests of the CUR rollup cube: the planner's choice of rollup, and rollup
+answers against the raw compacted rows
+"""
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import app as cost_app
+from stubs import cur_rows, write_cur_report
+
+
+@pytest.fixture
+def cube(tmp_path):
+    # Two partitions, the second starting mid-month, so rollups span partition edges
+    write_cur_report(str(tmp_path / 'report-1.csv'), cur_rows(datetime(2024, 1, 1), 24 * 45, seed=4))
+    write_cur_report(str(tmp_path / 'report-2.csv'), cur_rows(datetime(2024, 2, 10), 24 * 40, seed=5))
+    source = cost_app.CurSource(str(tmp_path))
+    source.ingest()
+    return source.cube
+
+
+def amounts(results):
+    flat = {}
+    for result in results:
+        cells = result['Groups'] or [{'Keys': [], 'Metrics': result['Total']}]
+        for cell in cells:
+            for metric, value in cell['Metrics'].items():
+                flat[(result['TimePeriod']['Start'], tuple(cell['Keys']), metric)] = float(value['Amount'])
+    return flat
+
+
+def edges(start, end, granularity):
+    return cost_app.period_edges(start, end, granularity)
+
+
+def test_plan_picks_the_coarsest_rollup_that_tiles_the_periods(cube):
+    assert cube.plan(edges('2024-01-01', '2024-03-01', 'MONTHLY'), set()) == ('MONTHLY', None)
+    assert cube.plan(edges('2024-01-15', '2024-03-01', 'MONTHLY'), {'SERVICE'}) == ('DAILY', 'SERVICE')
+    assert cube.plan(edges('2024-01-01', '2024-01-10', 'DAILY'), {'REGION'}) == ('DAILY', 'REGION')
+    assert cube.plan(edges('2024-01-01T05:00:00Z', '2024-01-01T09:00:00Z', 'HOURLY'), set()) == ('HOURLY', None)
+    assert cube.plan(edges('2024-01-01', '2024-03-01', 'MONTHLY'), {'SERVICE', 'REGION'}) == (None, None)
+
+
+@pytest.mark.parametrize('level', cost_app.CUR_ROLLUP_LEVELS)
+@pytest.mark.parametrize('dimension', (None,) + tuple(cost_app.CUR_DIMENSION_COLUMNS))
+def test_rollups_sum_the_raw_rows(cube, level, dimension):
+    for partition in cube.partitions.values():
+        rollup = partition.rollups[(level, dimension)]
+        assert np.all(np.diff(rollup.hours) >= 0)
+        expected = {}
+        buckets = cost_app.rollup_buckets(partition.hours, level)
+        codes = partition.dims[dimension] if dimension else np.zeros(len(buckets), dtype=np.int32)
+        for bucket, code, cost in zip(buckets.tolist(), codes.tolist(), partition.metrics['BlendedCost'].tolist()):
+            expected[(bucket, code)] = expected.get((bucket, code), 0.0) + cost
+        codes = rollup.dims[dimension] if dimension else np.zeros(len(rollup.hours), dtype=np.int32)
+        actual = dict(zip(zip(rollup.hours.tolist(), codes.tolist()), rollup.metrics['BlendedCost'].tolist()))
+        assert actual == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('start, end, granularity, group_by', [
+    ('2024-01-01', '2024-04-01', 'MONTHLY', []),
+    ('2024-01-20', '2024-03-05', 'MONTHLY', ['SERVICE']),
+    ('2024-02-01', '2024-02-20', 'DAILY', ['LINKED_ACCOUNT']),
+    ('2024-02-09T20:00:00Z', '2024-02-10T04:00:00Z', 'HOURLY', ['REGION']),
+    ('2024-01-01', '2024-03-01', 'MONTHLY', ['SERVICE', 'REGION']),
+])
+def test_rollup_answers_match_raw_rows(cube, monkeypatch, start, end, granularity, group_by):
+    query = {'TimePeriod': {'Start': start, 'End': end}, 'Granularity': granularity,
+             'Metrics': ['BlendedCost', 'UsageQuantity'],
+             'GroupBy': [{'Type': 'DIMENSION', 'Key': key} for key in group_by]}
+    planned = amounts(cube.results_by_time(query))
+    monkeypatch.setattr(cube, 'plan', lambda edges, dimensions: (None, None))
+    raw = amounts(cube.results_by_time(query))
+    assert planned == pytest.approx(raw)
+    assert len(raw) > 0
@@ -0,0 +1,64 @@
+"""
+Tests of coarser results derived locally from cached finer-grained ones
+"""
+from datetime import datetime, timedelta, timezone
+
+import app as cost_app
+from stubs import StubCostExplorerClient, request
+
+
+def install(stub: StubCostExplorerClient) -> StubCostExplorerClient:
+    cost_app.ce_client_manager.set_client(stub)
+    return stub
+
+
+def test_monthly_is_derived_from_cached_daily(monkeypatch):
+    stub = install(StubCostExplorerClient())
+    body = {'start_date': '2024-01-15', 'end_date': '2024-03-10', 'granularity': 'DAILY', 'group_by': 'SERVICE'}
+    request('POST', '/costs/analyze', json=body)
+    calls = len(stub.calls)
+    derived = request('POST', '/costs/analyze', json=dict(body, granularity='MONTHLY')).json()
+    assert len(stub.calls) == calls
+
+    cost_app.query_cache.clear()
+    cost_app.response_etags.clear()
+    monkeypatch.setattr(cost_app, 'cost_store', None)
+    fetched = request('POST', '/costs/analyze', json=dict(body, granularity='MONTHLY')).json()
+    assert len(stub.calls) > calls
+    assert derived == fetched
+    assert derived['chart_data']['labels'] == ['2024-01-15', '2024-02-01', '2024-03-01']
+
+
+def test_services_are_derived_from_the_dashboards_daily_data(monkeypatch):
+    stub = install(StubCostExplorerClient(groups=('Amazon EC2', 'Amazon S3', 'AWS Lambda')))
+    end = datetime.now(timezone.utc)
+    body = {
+        'start_date': (end - timedelta(days=10)).strftime('%Y-%m-%d'),
+        'end_date': end.strftime('%Y-%m-%d'),
+        'granularity': 'DAILY',
+        'group_by': 'SERVICE'
+    }
+    request('POST', '/costs/analyze', json=body)
+    calls = len(stub.calls)
+    derived = request('GET', '/costs/services', params={'days': 10}).json()
+    assert len(stub.calls) == calls
+
+    cost_app.query_cache.clear()
+    cost_app.response_etags.clear()
+    monkeypatch.setattr(cost_app, 'cost_store', None)
+    fetched = request('GET', '/costs/services', params={'days': 10}).json()
+    assert len(stub.calls) > calls
+    assert derived == fetched
+
+
+def test_resample_keeps_only_the_requested_metrics():
+    query = {'TimePeriod': {'Start': '2024-01-01', 'End': '2024-01-03'}, 'Granularity': 'MONTHLY',
+             'Metrics': ['BlendedCost']}
+    results = [
+        {'TimePeriod': {'Start': day, 'End': day}, 'Groups': [], 'Estimated': False,
+         'Total': {metric: {'Amount': amount, 'Unit': 'USD'}
+                   for metric, amount in (('BlendedCost', '1.5'), ('UnblendedCost', '9'), ('UsageQuantity', '4'))}}
+        for day in ('2024-01-01', '2024-01-02')
+    ]
+    resampled = cost_app.resample_results(results, query)
+    assert [result['Total'] for result in resampled] == [{'BlendedCost': {'Amount': '3.0', 'Unit': 'USD'}}]
@@ -0,0 +1,38 @@
+"""
+Tests of the ETag index: conditional requests answered without calling
+Cost Explorer, and only while the data behind the ETag stays fresh
+"""
+import app as cost_app
+from stubs import StubCostExplorerClient, request
+
+BODY = {'start_date': '2024-01-01', 'end_date': '2024-01-04', 'granularity': 'MONTHLY', 'group_by': 'SERVICE'}
+
+
+def test_analyze_is_cached_and_revalidated_with_etag():
+    stub = StubCostExplorerClient()
+    cost_app.ce_client_manager.set_client(stub)
+    first = request('POST', '/costs/analyze', json=BODY)
+    calls = len(stub.calls)
+    second = request('POST', '/costs/analyze', json=BODY, headers={'If-None-Match': first.headers['etag']})
+    assert second.status_code == 304
+    assert len(stub.calls) == calls
+
+
+def test_etag_expires_with_the_cached_data(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(cost_app.MemoryCacheBackend, 'clock', staticmethod(lambda: now[0]))
+    monkeypatch.setattr(cost_app, 'CE_CACHE_CLOSED_TTL', 100)
+    monkeypatch.setattr(cost_app.query_cache, 'max_stale', 10)
+    monkeypatch.setattr(cost_app, 'cost_store', None)
+    cost_app.ce_client_manager.set_client(StubCostExplorerClient())
+    request('POST', '/costs/analyze', json=BODY)
+
+    # Served from the cache just before it expires, so the ETag must not get a full TTL
+    now[0] = 99
+    etag = request('POST', '/costs/analyze', json=BODY).headers['etag']
+
+    now[0] = 120
+    cost_app.ce_client_manager.set_client(StubCostExplorerClient(groups=('Amazon EC2', 'Amazon S3', 'AWS Lambda')))
+    refreshed = request('POST', '/costs/analyze', json=BODY, headers={'If-None-Match': etag})
+    assert refreshed.status_code == 200
+    assert len(refreshed.json()['data']) == 3
@@ -0,0 +1,96 @@
+"""
+Tests of the local forecasting engine
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+import app as cost_app
+from stubs import StubCostExplorerClient, request
+
+
+class HistorySource:
+    """
+    Data source serving fixed daily costs per group, with some days marked Estimated
+    """
+
+    def __init__(self, daily, estimated=()):
+        self.daily = daily  # day -> {group: cost}
+        self.estimated = set(estimated)
+
+    async def iter_pages(self, query):
+        grouped = bool(query.get('GroupBy'))
+        results = []
+        for day, costs in sorted(self.daily.items()):
+            if not query['TimePeriod']['Start'] <= day < query['TimePeriod']['End']:
+                continue
+            amount = lambda cost: {'BlendedCost': {'Amount': str(cost), 'Unit': 'USD'}}
+            result = {'TimePeriod': {'Start': day, 'End': day}, 'Estimated': day in self.estimated, 'Groups': [], 'Total': {}}
+            if grouped:
+                result['Groups'] = [{'Keys': [group], 'Metrics': amount(cost)} for group, cost in costs.items()]
+            else:
+                result['Total'] = amount(sum(costs.values()))
+            results.append(result)
+        yield results
+
+
+def utc_day(offset: int) -> str:
+    return (datetime.now(timezone.utc) + timedelta(days=offset)).strftime('%Y-%m-%d')
+
+
+def forecast(source, start_offset=0, days=14, group_by=None):
+    query = {'TimePeriod': {'Start': utc_day(start_offset), 'End': utc_day(start_offset + days)},
+             'Metric': 'BLENDED_COST', 'Granularity': 'DAILY'}
+    return asyncio.run(cost_app.local_forecast(source, query, group_by))
+
+
+def means(response):
+    return [float(result['MeanValue']) for result in response['ForecastResultsByTime']]
+
+
+def test_linear_trend_continues_the_line():
+    history = np.array([[10.0 + 2 * day for day in range(10)]])
+    mean, lower, upper = cost_app.linear_trend_forecast(history, 3)
+    assert mean[0].tolist() == pytest.approx([30.0, 32.0, 34.0])
+    assert lower[0].tolist() == pytest.approx(mean[0].tolist())
+    assert upper[0].tolist() == pytest.approx(mean[0].tolist())
+
+
+def test_holt_winters_keeps_the_weekly_pattern():
+    week = [100.0, 100.0, 100.0, 100.0, 100.0, 20.0, 20.0]
+    history = np.array([week * 8, [value / 2 for value in week] * 8])
+    mean, lower, upper = cost_app.forecast_series(history, 7)
+    assert mean[0].tolist() == pytest.approx([week[(56 + i) % 7] for i in range(7)], rel=0.05)
+    assert mean[1].tolist() == pytest.approx([week[(56 + i) % 7] / 2 for i in range(7)], rel=0.05)
+    assert np.all(lower <= mean) and np.all(mean <= upper)
+
+
+def test_partial_trailing_days_are_left_out_of_the_fit():
+    daily = {utc_day(offset): {'Amazon EC2': 100.0} for offset in range(-60, 0)}
+    # Yesterday and the day before are still being billed, and today has barely started
+    daily[utc_day(-2)] = daily[utc_day(-1)] = {'Amazon EC2': 10.0}
+    daily[utc_day(0)] = {'Amazon EC2': 1.0}
+    source = HistorySource(daily, estimated=[utc_day(-2), utc_day(-1)])
+    assert means(forecast(source)) == pytest.approx([100.0] * 14, rel=0.02)
+    # Starting later, today and the days before the start are forecast too rather than read as zero spend
+    assert means(forecast(source, start_offset=3)) == pytest.approx([100.0] * 14, rel=0.02)
+
+
+def test_groups_are_forecast_together():
+    daily = {utc_day(offset): {'Amazon EC2': 60.0, 'Amazon S3': 40.0} for offset in range(-30, 0)}
+    response = forecast(HistorySource(daily), group_by='SERVICE')
+    assert means(response) == pytest.approx([100.0] * 14, rel=0.02)
+    groups = {group['Keys'][0]: means(group) for group in response['Groups']}
+    assert groups['Amazon EC2'] == pytest.approx([60.0] * 14, rel=0.02)
+    assert groups['Amazon S3'] == pytest.approx([40.0] * 14, rel=0.02)
+
+
+def test_forecast_endpoint_uses_the_local_engine():
+    stub = StubCostExplorerClient()
+    cost_app.ce_client_manager.set_client(stub)
+    content = request('GET', '/costs/forecast', params={'days': 7}).json()
+    assert len(content['forecast_data']) == 7
+    assert content['total_forecast'] > 0
+    assert all('get_cost_forecast' not in str(call) for call in stub.calls)
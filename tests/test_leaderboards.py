@@ -0,0 +1,24 @@
+"""
+Tests of the in-memory service leaderboards
+"""
+import asyncio
+
+import app as cost_app
+from stubs import StubCostExplorerClient, request
+
+
+def test_refresh_fetches_fresh_data_and_refills_the_cache():
+    cost_app.ce_client_manager.set_client(StubCostExplorerClient())
+    request('GET', '/costs/services', params={'days': 7})
+
+    fresh = StubCostExplorerClient(groups=('Amazon EC2', 'Amazon S3', 'AWS Lambda'))
+    cost_app.ce_client_manager.set_client(fresh)
+    boards = cost_app.Leaderboards([7])
+    asyncio.run(boards.refresh())
+    assert fresh.calls
+    assert boards.get(7).keys[0] == 'AWS Lambda'
+
+    calls = len(fresh.calls)
+    content = request('GET', '/costs/services', params={'days': 7}).json()
+    assert len(fresh.calls) == calls
+    assert content['total_services'] == 3
@@ -0,0 +1,55 @@
+"""
+Tests of NextPageToken pagination with one page prefetched
+"""
+import asyncio
+
+import app as cost_app
+from stubs import StubCostExplorerClient, request
+
+QUERY = {
+    'TimePeriod': {'Start': '2024-01-01', 'End': '2024-01-11'},
+    'Granularity': 'DAILY',
+    'Metrics': ['BlendedCost'],
+    'GroupBy': [{'Type': 'DIMENSION', 'Key': 'SERVICE'}]
+}
+
+
+def collect(pages, limit=None):
+    async def run():
+        collected = []
+        try:
+            async for results in pages:
+                collected.append(results)
+                if len(collected) == limit:
+                    break
+        finally:
+            await pages.aclose()
+        return collected
+    return asyncio.run(run())
+
+
+def test_analyze_follows_pages():
+    cost_app.ce_client_manager.set_client(StubCostExplorerClient(page_size=7))
+    content = request('POST', '/costs/analyze', json={
+        'start_date': '2024-01-01', 'end_date': '2024-02-01', 'granularity': 'DAILY', 'group_by': 'SERVICE'
+    }).json()
+    assert len(content['chart_data']['labels']) == 31
+    assert content['total_cost'] == sum(day + day + 1 for day in range(1, 32))
+
+
+def test_pages_are_yielded_in_order():
+    stub = StubCostExplorerClient(page_size=3)
+    cost_app.ce_client_manager.set_client(stub)
+    pages = collect(cost_app.iter_cost_and_usage_pages(QUERY))
+    assert [len(page) for page in pages] == [3, 3, 3, 1]
+    assert [result['TimePeriod']['Start'] for page in pages for result in page] == [
+        f'2024-01-{day:02d}' for day in range(1, 11)]
+    assert [call.get('NextPageToken') for call in stub.calls] == [None, '3', '6', '9']
+
+
+def test_only_one_page_is_fetched_ahead():
+    stub = StubCostExplorerClient(page_size=2)
+    cost_app.ce_client_manager.set_client(stub)
+    pages = collect(cost_app.iter_cost_and_usage_pages(QUERY), limit=1)
+    assert len(pages) == 1
+    assert len(stub.calls) <= 2
@@ -0,0 +1,51 @@
+"""
+Tests of the top-k rankings behind /costs/services
+"""
+import math
+import random
+
+import app as cost_app
+from stubs import StubCostExplorerClient, request
+
+
+def test_services_ranks_by_cost():
+    cost_app.ce_client_manager.set_client(StubCostExplorerClient(groups=('Amazon EC2', 'Amazon S3', 'AWS Lambda')))
+    response = request('GET', '/costs/services', params={'days': 10, 'limit': 2})
+    assert response.status_code == 200
+    content = response.json()
+    assert [entry['service'] for entry in content['top_services']] == ['AWS Lambda', 'Amazon S3']
+    assert content['total_services'] == 3
+    assert content['other']['count'] == 1
+    assert content['as_of'] is None
+
+
+def test_rank_totals_matches_a_full_sort():
+    rng = random.Random(7)
+    totals = {f'service-{i}': rng.uniform(0, 1000) for i in range(500)}
+    ranked = sorted(totals.items(), key=lambda x: x[1], reverse=True)
+    for limit in (0, 1, 10, 500, 600):
+        ranking = cost_app.rank_totals(totals, limit)
+        assert [entry['key'] for entry in ranking['top']] == [key for key, _ in ranked[:limit]]
+        assert ranking['other']['count'] == max(len(totals) - limit, 0)
+        assert ranking['other']['cost'] == round(math.fsum(cost for _, cost in ranked[limit:]), 2)
+        assert ranking['total_keys'] == 500
+
+
+def test_rank_nested_totals_breaks_down_the_top_parents():
+    totals = {
+        ('us-east-1', 'Amazon EC2'): 50.0, ('us-east-1', 'Amazon S3'): 30.0, ('us-east-1', 'AWS Lambda'): 5.0,
+        ('eu-west-1', 'Amazon EC2'): 40.0,
+        ('ap-south-1', 'Amazon S3'): 1.0
+    }
+    ranking = cost_app.rank_nested_totals(totals, limit=2, parent_limit=2)
+    assert [entry['key'] for entry in ranking['top']] == ['us-east-1', 'eu-west-1']
+    east = ranking['top'][0]
+    assert east['cost'] == 85.0
+    assert [child['key'] for child in east['top']] == ['Amazon EC2', 'Amazon S3']
+    assert east['other'] == {'count': 1, 'cost': 5.0}
+    assert ranking['other'] == {'count': 1, 'cost': 1.0}
+
+
+def test_invalid_dimension_is_rejected():
+    response = request('GET', '/costs/services', params={'dimension': 'service; drop'})
+    assert response.status_code == 400
@@ -0,0 +1,117 @@
+"""
+Tests of the adaptive rate limiter and the retry classification of
+Cost Explorer errors
+"""
+import asyncio
+import time
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+import app as cost_app
+from stubs import StubCostExplorerClient
+
+
+def test_rate_halves_on_throttles_and_recovers_additively():
+    limiter = cost_app.AdaptiveRateLimiter(max_rate=8, min_rate=1.5, increase=0.5, burst=1)
+    rates = []
+    for _ in range(4):
+        limiter.on_throttle()
+        rates.append(limiter.rate)
+    assert rates == [4, 2, 1.5, 1.5]
+    for _ in range(3):
+        limiter.on_success()
+    assert limiter.rate == 3
+    for _ in range(20):
+        limiter.on_success()
+    assert limiter.rate == 8
+    assert limiter.throttles == 4
+
+
+def test_waiters_are_served_by_priority_then_arrival():
+    limiter = cost_app.AdaptiveRateLimiter(max_rate=200, burst=1)
+    order = []
+
+    async def acquire(name, priority):
+        await limiter.acquire(priority, time.monotonic() + 5)
+        order.append(name)
+
+    async def run():
+        await limiter.acquire(cost_app.PRIORITY_INTERACTIVE, time.monotonic() + 5)  # empty the bucket
+        await asyncio.gather(
+            acquire('background-1', cost_app.PRIORITY_BACKGROUND),
+            acquire('interactive-1', cost_app.PRIORITY_INTERACTIVE),
+            acquire('background-2', cost_app.PRIORITY_BACKGROUND),
+            acquire('interactive-2', cost_app.PRIORITY_INTERACTIVE),
+        )
+
+    asyncio.run(run())
+    assert order == ['interactive-1', 'interactive-2', 'background-1', 'background-2']
+
+
+def test_waiter_gives_up_at_its_deadline_without_using_a_token():
+    limiter = cost_app.AdaptiveRateLimiter(max_rate=5, burst=1)
+
+    async def run():
+        await limiter.acquire(cost_app.PRIORITY_INTERACTIVE, time.monotonic() + 5)
+        with pytest.raises(asyncio.TimeoutError):
+            await limiter.acquire(cost_app.PRIORITY_INTERACTIVE, time.monotonic() + 0.05)
+        await limiter.acquire(cost_app.PRIORITY_INTERACTIVE, time.monotonic() + 5)
+
+    asyncio.run(run())
+    assert limiter.granted == 2
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(cost_app, 'CE_RETRY_BASE_DELAY', 0.001)
+    monkeypatch.setattr(cost_app, 'CE_RETRY_MAX_DELAY', 0.005)
+
+
+def call(deadline: float = 5.0):
+    async def run():
+        cost_app.ce_deadline.set(time.monotonic() + deadline)
+        return await cost_app.call_ce_with_retry('get_cost_and_usage', TimePeriod={'Start': '2024-01-01', 'End': '2024-01-02'},
+                                                 Granularity='DAILY', Metrics=['BlendedCost'])
+    return asyncio.run(run())
+
+
+def test_throttles_are_retried_and_slow_the_limiter(fast_retries):
+    stub = StubCostExplorerClient(throttles=2)
+    cost_app.ce_client_manager.set_client(stub)
+    call()
+    assert len(stub.calls) == 3
+    assert cost_app.ce_rate_limiter.throttles == 2
+
+
+def test_other_client_errors_are_not_retried(fast_retries):
+    stub = StubCostExplorerClient(error='ValidationException')
+    cost_app.ce_client_manager.set_client(stub)
+    with pytest.raises(ClientError):
+        call()
+    assert len(stub.calls) == 1
+    assert cost_app.ce_rate_limiter.throttles == 0
+
+
+def test_connection_errors_are_retried(fast_retries):
+    class FlakyClient(StubCostExplorerClient):
+        def get_cost_and_usage(self, **query):
+            if not self.calls:
+                self.calls.append(query)
+                raise EndpointConnectionError(endpoint_url='https://ce.us-east-1.amazonaws.com')
+            return super().get_cost_and_usage(**query)
+
+    stub = FlakyClient()
+    cost_app.ce_client_manager.set_client(stub)
+    call()
+    assert len(stub.calls) == 2
+    assert cost_app.ce_rate_limiter.throttles == 0
+
+
+def test_retries_stop_at_the_attempt_limit(fast_retries):
+    stub = StubCostExplorerClient(throttles=100)
+    cost_app.ce_client_manager.set_client(stub)
+    with pytest.raises(ClientError) as raised:
+        call()
+    assert cost_app.is_throttling_error(raised.value)
+    assert len(stub.calls) == cost_app.CE_RETRY_MAX_ATTEMPTS
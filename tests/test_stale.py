@@ -0,0 +1,72 @@
+"""
+Tests of stale-while-revalidate serving of cached Cost Explorer data
+"""
+import asyncio
+
+import httpx
+import pytest
+
+import app as cost_app
+from stubs import StubCostExplorerClient, request
+
+BODY = {'start_date': '2024-01-01', 'end_date': '2024-01-04', 'granularity': 'MONTHLY', 'group_by': 'SERVICE'}
+THREE_GROUPS = ('Amazon EC2', 'Amazon S3', 'AWS Lambda')
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(cost_app.MemoryCacheBackend, 'clock', staticmethod(lambda: now[0]))
+    monkeypatch.setattr(cost_app, 'CE_CACHE_CLOSED_TTL', 100)
+    monkeypatch.setattr(cost_app.query_cache, 'max_stale', 50)
+    monkeypatch.setattr(cost_app, 'cost_store', None)
+    return now
+
+
+def test_stale_entry_is_served_and_refreshed_in_the_background(clock):
+    cost_app.ce_client_manager.set_client(StubCostExplorerClient())
+    request('POST', '/costs/analyze', json=BODY)
+    refreshed = StubCostExplorerClient(groups=THREE_GROUPS)
+    cost_app.ce_client_manager.set_client(refreshed)
+    clock[0] = 120
+
+    async def run():
+        transport = httpx.ASGITransport(app=cost_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            stale = await client.post('/costs/analyze', json=BODY)
+            for _ in range(100):
+                if not cost_app.ce_single_flight._in_flight:
+                    break
+                await asyncio.sleep(0.01)
+            fresh = await client.post('/costs/analyze', json=BODY)
+        return stale, fresh
+
+    stale, fresh = asyncio.run(run())
+    assert stale.headers['x-cache'] == 'STALE'
+    assert len(stale.json()['data']) == 2
+    assert len(refreshed.calls) == 1
+    assert 'x-cache' not in fresh.headers
+    assert len(fresh.json()['data']) == 3
+
+
+def test_entry_past_max_stale_is_fetched_again(clock):
+    cost_app.ce_client_manager.set_client(StubCostExplorerClient())
+    request('POST', '/costs/analyze', json=BODY)
+    refreshed = StubCostExplorerClient(groups=THREE_GROUPS)
+    cost_app.ce_client_manager.set_client(refreshed)
+    clock[0] = 151
+    response = request('POST', '/costs/analyze', json=BODY)
+    assert 'x-cache' not in response.headers
+    assert len(response.json()['data']) == 3
+
+
+def test_fresh_entry_is_not_marked_stale(clock):
+    stub = StubCostExplorerClient()
+    cost_app.ce_client_manager.set_client(stub)
+    request('POST', '/costs/analyze', json=BODY)
+    clock[0] = 99
+    response = request('GET', '/costs/services', params={'days': 10})
+    assert 'x-cache' not in response.headers
+    response = request('POST', '/costs/analyze', json=BODY)
+    assert 'x-cache' not in response.headers
+    assert len(stub.calls) == 2
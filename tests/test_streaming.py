@@ -0,0 +1,39 @@
+"""
+Tests of the NDJSON streaming mode of /costs/analyze
+"""
+import orjson
+
+import app as cost_app
+from stubs import StubCostExplorerClient, request
+
+JANUARY = {'start_date': '2024-01-01', 'end_date': '2024-02-01', 'granularity': 'DAILY', 'group_by': 'SERVICE'}
+
+
+def test_analyze_streams_gzipped_ndjson():
+    cost_app.ce_client_manager.set_client(StubCostExplorerClient(page_size=5))
+    response = request('POST', '/costs/analyze', json=dict(JANUARY, stream=True),
+                       headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+    # httpx decodes the body; the header shows it was sent gzipped
+    lines = [orjson.loads(line) for line in response.content.splitlines()]
+    assert len(lines) == 31 * 2 + 1
+    assert lines[-1]['type'] == 'trailer'
+    assert lines[-1]['total_cost'] == sum(row['cost'] for row in lines[:-1])
+
+
+def test_streamed_rows_match_the_buffered_response():
+    cost_app.ce_client_manager.set_client(StubCostExplorerClient(page_size=7))
+    buffered = request('POST', '/costs/analyze', json=JANUARY).json()
+    response = request('POST', '/costs/analyze', json=JANUARY, headers={'Accept': cost_app.NDJSON_MEDIA_TYPE})
+    assert response.headers['content-type'].startswith(cost_app.NDJSON_MEDIA_TYPE)
+    lines = [orjson.loads(line) for line in response.content.splitlines()]
+    assert sorted((row['period_start'], row['group'], row['cost']) for row in lines[:-1]) == sorted(
+        (row['period_start'], row['group'], row['cost']) for row in buffered['data'])
+    assert lines[-1]['total_cost'] == buffered['total_cost']
+
+
+def test_error_before_the_first_page_keeps_its_status():
+    cost_app.ce_client_manager.set_client(StubCostExplorerClient(error='AccessDeniedException'))
+    response = request('POST', '/costs/analyze', json=dict(JANUARY, stream=True))
+    assert response.status_code == 500
+    assert 'AWS API Error' in response.json()['detail']
@@ -0,0 +1,61 @@
+"""
+Tests of the startup cache warm-up and the readiness it gates
+"""
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import app as cost_app
+from stubs import StubCostExplorerClient, request
+
+
+def health():
+    return request('GET', '/health').json()
+
+
+def test_warmup_fills_the_cache_for_the_dashboard(tmp_path, monkeypatch):
+    path = tmp_path / 'warmup.json'
+    path.write_text(json.dumps([{'endpoint': 'services', 'days': 7, 'dimension': 'REGION'}]))
+    warmup = cost_app.CacheWarmup(str(path))
+    monkeypatch.setattr(cost_app, 'cache_warmup', warmup)
+    stub = StubCostExplorerClient()
+    cost_app.ce_client_manager.set_client(stub)
+    assert health()['ready'] is False
+
+    asyncio.run(warmup.run())
+    status = health()
+    assert status['ready'] is True
+    assert status['warmup']['warmed'] == 3 and status['warmup']['errors'] == []
+
+    calls = len(stub.calls)
+    today = datetime.now(timezone.utc).date()
+    request('POST', '/costs/analyze', json={
+        'start_date': (today - timedelta(days=30)).isoformat(), 'end_date': today.isoformat(), 'granularity': 'DAILY'
+    })
+    request('GET', '/costs/services', params={'days': 30, 'limit': 10})
+    request('GET', '/costs/services', params={'days': 7, 'dimension': 'REGION'})
+    assert len(stub.calls) == calls
+
+
+def test_failed_entries_are_reported_without_blocking_readiness(tmp_path, monkeypatch):
+    path = tmp_path / 'warmup.json'
+    path.write_text(json.dumps([{'endpoint': 'unknown'}]))
+    warmup = cost_app.CacheWarmup(str(path))
+    monkeypatch.setattr(cost_app, 'cache_warmup', warmup)
+    cost_app.ce_client_manager.set_client(StubCostExplorerClient())
+    asyncio.run(warmup.run())
+    status = health()
+    assert status['ready'] is True
+    assert status['warmup']['warmed'] == 2
+    assert [error['entry'] for error in status['warmup']['errors']] == [{'endpoint': 'unknown'}]
+
+
+def test_cur_source_is_not_ready_before_its_first_ingest(tmp_path, monkeypatch):
+    warmup = cost_app.CacheWarmup('')
+    warmup.done = True
+    monkeypatch.setattr(cost_app, 'cache_warmup', warmup)
+    source = cost_app.CurSource(str(tmp_path))
+    monkeypatch.setattr(cost_app, 'cost_source', source)
+    assert health()['ready'] is False
+    source.ingest()
+    assert health()['ready'] is True